@@ -0,0 +1,269 @@
+import tempfile
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from tracing import count
+
+ASR_BACKENDS = ("google", "azure", "whisper")
+SAMPLE_RATE = 16000
+
+
+def iter_pcm_blocks(path, sample_rate=SAMPLE_RATE, block_seconds=0.5):
+    from pydub import AudioSegment
+    block_bytes = int(sample_rate * block_seconds) * 2
+    command = [AudioSegment.converter, "-v", "error", "-nostdin", "-i", path,
+               "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sample_rate), "-"]
+    # stderr goes to a temporary file rather than a pipe: nothing reads it while decoding, and a full pipe would block ffmpeg
+    errors = tempfile.TemporaryFile()
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors)
+    except FileNotFoundError:
+        errors.close()
+        # Without ffmpeg pydub can still read plain WAV files, just not incrementally
+        audio = AudioSegment.from_file(path).set_channels(1).set_frame_rate(sample_rate).set_sample_width(2)
+        samples = np.frombuffer(audio.raw_data, dtype=np.int16)
+        for start in range(0, len(samples), block_bytes // 2):
+            yield samples[start:start + block_bytes // 2]
+        return
+    try:
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            yield np.frombuffer(data[:len(data) // 2 * 2], dtype=np.int16)
+        if process.wait() != 0:
+            errors.seek(0)
+            raise RuntimeError(f"Could not decode {path}: {errors.read().decode(errors='replace').strip()}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        errors.close()
+
+
+class VoiceActivitySegmenter:
+    def __init__(self, sample_rate=SAMPLE_RATE, frame_ms=30, silence_ms=500, min_speech_ms=250,
+                 max_segment_seconds=15.0, padding_ms=200, threshold_ratio=3.0, min_rms=150.0, calibration_ms=500,
+                 noise_percentile=10):
+        self.sample_rate = sample_rate
+        self.frame = int(sample_rate * frame_ms / 1000)
+        self.silence_frames = max(1, silence_ms // frame_ms)
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.max_segment_frames = int(max_segment_seconds * 1000 / frame_ms)
+        self.padding_frames = padding_ms // frame_ms
+        self.threshold_ratio = threshold_ratio
+        self.min_rms = min_rms
+        self.calibration_frames = max(1, calibration_ms // frame_ms)
+        self.noise_percentile = noise_percentile
+        self.calibration = []
+        self.noise_floor = None
+        self.remainder = np.zeros(0, dtype=np.int16)
+        self.history = deque(maxlen=self.padding_frames)
+        self.segment = []
+        self.speech_frames = 0
+        self.trailing_silence = 0
+        self.position = 0
+        self.segment_start = 0
+
+    def feed(self, samples):
+        samples = np.concatenate([self.remainder, np.asarray(samples, dtype=np.int16)])
+        usable = len(samples) // self.frame * self.frame
+        self.remainder = samples[usable:]
+        frames = samples[:usable].reshape(-1, self.frame)
+        energies = np.sqrt(np.mean(frames.astype(np.float32) ** 2, axis=1))
+        for frame, energy in zip(frames, energies):
+            if self.noise_floor is None:
+                self.calibration.append((frame, energy))
+                if len(self.calibration) >= self.calibration_frames:
+                    yield from self.calibrate()
+                continue
+            segment = self.process(frame, energy)
+            if segment is not None:
+                yield segment
+
+    def calibrate(self):
+        # A low percentile of the opening frames, so a recording that starts mid-speech does not set the floor at speech level
+        frames, self.calibration = self.calibration, []
+        self.noise_floor = float(np.percentile([energy for _, energy in frames], self.noise_percentile))
+        for frame, energy in frames:
+            segment = self.process(frame, energy)
+            if segment is not None:
+                yield segment
+
+    def process(self, frame, energy):
+        is_speech = energy >= max(self.min_rms, self.noise_floor * self.threshold_ratio)
+        # Track the background level between utterances so the threshold adapts to noisy recordings
+        if energy < self.noise_floor:
+            self.noise_floor = energy
+        elif not is_speech:
+            self.noise_floor += 0.05 * (energy - self.noise_floor)
+        self.position += 1
+
+        if not self.segment:
+            if is_speech:
+                self.segment_start = self.position - 1 - len(self.history)
+                self.segment = list(self.history) + [frame]
+                self.speech_frames, self.trailing_silence = 1, 0
+            else:
+                self.history.append(frame)
+            return None
+
+        self.segment.append(frame)
+        if is_speech:
+            self.speech_frames += 1
+            self.trailing_silence = 0
+        else:
+            self.trailing_silence += 1
+        if self.trailing_silence >= self.silence_frames or len(self.segment) >= self.max_segment_frames:
+            return self.close()
+        return None
+
+    def close(self):
+        segment, speech_frames, start = self.segment, self.speech_frames, self.segment_start
+        self.segment, self.speech_frames, self.trailing_silence = [], 0, 0
+        self.history.clear()
+        if speech_frames < self.min_speech_frames:
+            return None
+        return start * self.frame / self.sample_rate, np.concatenate(segment)
+
+    def flush(self):
+        if self.calibration:
+            yield from self.calibrate()
+        if self.segment:
+            segment = self.close()
+            if segment is not None:
+                yield segment
+
+
+class GoogleBackend:
+    name = "google"
+
+    def __init__(self, language="en-IN"):
+        self.language = language
+
+    def transcribe(self, samples, sample_rate):
+        import speech_recognition as sr
+        try:
+            return sr.Recognizer().recognize_google(sr.AudioData(samples.tobytes(), sample_rate, 2), language=self.language)
+        except sr.UnknownValueError:
+            return ""
+
+
+class AzureSpeechBackend:
+    name = "azure"
+
+    def __init__(self, key, region, languages=("en-IN",)):
+        self.key = key
+        self.region = region
+        self.languages = list(languages)
+
+    def transcribe(self, samples, sample_rate):
+        import azure.cognitiveservices.speech as speechsdk
+        speech_config = speechsdk.SpeechConfig(subscription=self.key, region=self.region)
+        stream = speechsdk.audio.PushAudioInputStream(
+            stream_format=speechsdk.audio.AudioStreamFormat(samples_per_second=sample_rate, bits_per_sample=16, channels=1)
+        )
+        stream.write(samples.tobytes())
+        stream.close()
+        options = {}
+        if len(self.languages) > 1:
+            # At-start language identification accepts up to four candidates
+            options["auto_detect_source_language_config"] = speechsdk.languageconfig.AutoDetectSourceLanguageConfig(
+                languages=self.languages[:4]
+            )
+        else:
+            speech_config.speech_recognition_language = self.languages[0]
+        recognizer = speechsdk.SpeechRecognizer(
+            speech_config=speech_config, audio_config=speechsdk.audio.AudioConfig(stream=stream), **options
+        )
+        result = recognizer.recognize_once_async().get()
+        if result.reason == speechsdk.ResultReason.RecognizedSpeech:
+            return result.text
+        if result.reason == speechsdk.ResultReason.NoMatch:
+            return ""
+        raise RuntimeError(f"Azure speech recognition failed: {result.cancellation_details.error_details}")
+
+
+class WhisperBackend:
+    name = "whisper"
+
+    def __init__(self, model_name="openai/whisper-small", device="cpu"):
+        self.model_name = model_name
+        self.device = device
+        self.model = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.model is None:
+            with self.lock:
+                if self.model is None:
+                    from transformers import pipeline
+                    self.model = pipeline("automatic-speech-recognition", model=self.model_name, device=self.device)
+        return self.model
+
+    def transcribe(self, samples, sample_rate):
+        model = self.load()
+        # One segment at a time: the model already uses every core
+        with self.lock:
+            result = model({"raw": samples.astype(np.float32) / 32768.0, "sampling_rate": sample_rate})
+        return result["text"].strip()
+
+
+def create_asr_backend(backend="google", languages=("en-IN",), azure_key=None, azure_region=None,
+                       whisper_model="openai/whisper-small"):
+    if backend == "google":
+        return GoogleBackend(languages[0])
+    if backend == "azure":
+        return AzureSpeechBackend(azure_key, azure_region, languages)
+    if backend == "whisper":
+        return WhisperBackend(whisper_model)
+    raise ValueError(f"Unknown ASR backend {backend!r}, expected one of {', '.join(ASR_BACKENDS)}")
+
+
+class StreamingRecognizer:
+    def __init__(self, backend, workers=4, max_segment_seconds=15.0, silence_ms=500, sample_rate=SAMPLE_RATE):
+        self.backend = backend
+        self.max_segment_seconds = max_segment_seconds
+        self.silence_ms = silence_ms
+        self.sample_rate = sample_rate
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.workers = workers
+
+    def transcribe_segment(self, start, samples):
+        try:
+            return self.backend.transcribe(samples, self.sample_rate).strip()
+        except Exception as e:
+            print(f"⚠️ Speech recognition error at {start:.1f}s: {e}")
+            count("errors", stage="asr_segment")
+            return ""
+
+    def stream(self, blocks):
+        segmenter = VoiceActivitySegmenter(self.sample_rate, silence_ms=self.silence_ms,
+                                           max_segment_seconds=self.max_segment_seconds)
+        pending, texts = deque(), []
+
+        def ready(wait):
+            while pending and (wait or pending[0].done()):
+                wait = False
+                text = pending.popleft().result()
+                if text:
+                    texts.append(text)
+                    yield " ".join(texts)
+
+        def segments():
+            for samples in blocks:
+                yield from segmenter.feed(samples)
+            yield from segmenter.flush()
+
+        for start, samples in segments():
+            count("asr_segments")
+            pending.append(self.executor.submit(self.transcribe_segment, start, samples))
+            # Bound the audio held in memory when decoding outpaces recognition
+            yield from ready(len(pending) > self.workers * 2)
+        while pending:
+            yield from ready(True)
+
+    def stream_file(self, path):
+        return self.stream(iter_pcm_blocks(path, self.sample_rate))
@@ -0,0 +1,181 @@
+import os
+import asyncio
+import aiohttp
+import openai
+from tracing import annotate, count, span, trace
+from language import reply_language, translation_source
+from main import (
+    AZURE_OPENAI_DEPLOYMENT,
+    AZURE_TRANSLATOR_KEY,
+    AZURE_TRANSLATOR_ENDPOINT,
+    EMBEDDING_TIMEOUT_SECONDS,
+    cached_translation,
+    detect_language,
+    generate_speech,
+    get_translation_cache,
+    not_found_message,
+    prepare_completion,
+    query_cache,
+    record_turn,
+    recognize_audio_file,
+    save_text_to_file,
+    setup_openai,
+    setup_tracing,
+    translate_answer,
+    translation_key,
+)
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "100"))
+
+STAGE_TIMEOUTS = {
+    "recognize": 300.0,
+    "detect": 5.0,
+    "translate": 10.0,
+    "retrieve": EMBEDDING_TIMEOUT_SECONDS + 5.0,
+    "chat": 60.0,
+    "speech": 60.0,
+    "save": 10.0,
+}
+for _stage in STAGE_TIMEOUTS:
+    STAGE_TIMEOUTS[_stage] = float(os.getenv(f"STAGE_TIMEOUT_{_stage.upper()}", STAGE_TIMEOUTS[_stage]))
+
+_sessions = {}
+_translators = {}
+
+
+def get_http_session():
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, ttl_dns_cache=300)
+        session = aiohttp.ClientSession(connector=connector)
+        _sessions[loop] = session
+    return session
+
+def get_async_translator_client():
+    loop = asyncio.get_running_loop()
+    client = _translators.get(loop)
+    if client is None:
+        from azure.core.credentials import AzureKeyCredential
+        from azure.core.pipeline.transport import AioHttpTransport
+        from azure.ai.translation.text.aio import TextTranslationClient
+        client = TextTranslationClient(
+            credential=AzureKeyCredential(AZURE_TRANSLATOR_KEY),
+            endpoint=AZURE_TRANSLATOR_ENDPOINT,
+            transport=AioHttpTransport(session=get_http_session(), session_owner=False),
+        )
+        _translators[loop] = client
+    return client
+
+async def close_http_sessions():
+    loop = asyncio.get_running_loop()
+    client = _translators.pop(loop, None)
+    if client is not None:
+        await client.close()
+    session = _sessions.pop(loop, None)
+    if session is not None:
+        await session.close()
+
+async def run_stage(name, awaitable):
+    with span(name):
+        try:
+            return await asyncio.wait_for(awaitable, STAGE_TIMEOUTS[name])
+        except asyncio.TimeoutError:
+            print(f"⚠️ Stage '{name}' timed out after {STAGE_TIMEOUTS[name]:.0f}s")
+            raise
+
+async def translate_text_async(text, from_lang, to_lang):
+    cached = cached_translation(text, from_lang, to_lang)
+    count("cache_hits" if cached is not None else "cache_misses", cache="translation")
+    if cached is not None:
+        return cached
+    try:
+        body = {"contents": [text], "to": [to_lang]}
+        if from_lang:
+            body["from"] = from_lang
+        response = await run_stage("translate", get_async_translator_client().translate(body=body))
+        translation = response[0].translations[0].text
+        get_translation_cache().set(translation_key(text, from_lang, to_lang), translation)
+        return translation
+    except Exception as e:
+        print(f"⚠️ Translation failed: {e!r}")
+        return text
+
+async def get_response_from_faiss_async(query, detected_lang="en", knowledge_base=None, session_id=None, filters=None):
+    # Retrieval is CPU-bound or uses the blocking embedding client, so only the chat call runs on the event loop
+    try:
+        answer, prompt = await run_stage("retrieve", asyncio.to_thread(
+            prepare_completion, query, detected_lang, knowledge_base, session_id, filters
+        ))
+    except asyncio.TimeoutError:
+        return not_found_message(detected_lang)
+    if prompt is None:
+        return answer
+    messages, query_embedding, version, scope_key = prompt
+
+    setup_openai()
+    openai.aiosession.set(get_http_session())
+    try:
+        completion = await run_stage("chat", openai.ChatCompletion.acreate(
+            engine=AZURE_OPENAI_DEPLOYMENT,
+            temperature=0.3,
+            messages=messages
+        ))
+        answer = completion["choices"][0]["message"]["content"]
+        usage = completion.get("usage") or {}
+        count("tokens", usage.get("prompt_tokens", 0), kind="prompt")
+        count("tokens", usage.get("completion_tokens", 0), kind="completion")
+    except Exception as e:
+        return f"⚠️ Error generating response: {e!r}"
+    query_cache.set(query, query_embedding, answer, version, scope_key)
+    return answer
+
+async def process_input_async(input_text_or_file, knowledge_base=None, session_id=None, filters=None):
+    setup_tracing()
+    with trace("process_input_async"):
+        if await asyncio.to_thread(os.path.isfile, input_text_or_file):
+            try:
+                input_text = await run_stage("recognize", asyncio.to_thread(recognize_audio_file, input_text_or_file))
+            except asyncio.TimeoutError:
+                message = "⚠️ Speech recognition timed out, please try a shorter recording."
+                return message, None, "", message
+        else:
+            input_text = input_text_or_file
+
+        save_input = asyncio.create_task(run_stage("save", asyncio.to_thread(save_text_to_file, input_text, "input")))
+
+        try:
+            detected_lang = await run_stage("detect", asyncio.to_thread(detect_language, input_text))
+        except asyncio.TimeoutError:
+            detected_lang = "en"
+        annotate(language=detected_lang, input_chars=len(input_text))
+
+        reply_lang = reply_language(detected_lang)
+        translated_query = await translate_text_async(input_text, translation_source(detected_lang), "en") if detected_lang != "en" else input_text
+        response_text = await get_response_from_faiss_async(translated_query, detected_lang, knowledge_base, session_id, filters)
+
+        final_response = response_text
+        if reply_lang != "en":
+            try:
+                final_response = await run_stage("translate", asyncio.to_thread(translate_answer, response_text, "en", reply_lang))
+            except asyncio.TimeoutError:
+                pass
+
+        await asyncio.to_thread(record_turn, session_id, translated_query, response_text)
+
+        save_output = asyncio.create_task(run_stage("save", asyncio.to_thread(save_text_to_file, final_response, "output")))
+        try:
+            audio_file = await run_stage("speech", asyncio.to_thread(generate_speech, final_response, reply_lang))
+        except asyncio.TimeoutError:
+            # The answer is already computed, so it is returned without audio
+            audio_file = None
+        except Exception as e:
+            print(f"⚠️ Speech synthesis error: {e!r}")
+            audio_file = None
+
+        for saved in await asyncio.gather(save_input, save_output, return_exceptions=True):
+            if isinstance(saved, Exception):
+                print(f"⚠️ Failed to save transcript: {saved!r}")
+
+        # The English turn is returned too, so coalesced followers can record it in their own sessions
+        return final_response, audio_file, translated_query, response_text
@@ -0,0 +1,238 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import threading
+import contextvars
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import openai
+import main as app
+from language import LANGUAGES, reply_language, translation_source
+from tracing import annotate, count, span, trace
+from vectors import EMBEDDING_WORKERS, generate_embeddings, retry_delay
+
+BATCH_SIZE = int(os.getenv("BATCH_QA_SIZE", "256"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_QA_CONCURRENCY", "8"))
+BATCH_MAX_RETRIES = int(os.getenv("BATCH_QA_MAX_RETRIES", "4"))
+
+RETRYABLE_CHAT_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.APIError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+)
+
+
+def read_questions(path, question_field="question", id_field="id"):
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            records = list(csv.DictReader(f))
+        else:
+            records = [json.loads(line) for line in f if line.strip()]
+    rows, seen = [], set()
+    for number, record in enumerate(records, 1):
+        question = str(record.get(question_field) or "").strip()
+        if not question:
+            print(f"!! Row {number} has no {question_field!r}, skipping.")
+            continue
+        row_id = record.get(id_field)
+        row_id = str(number if row_id is None else row_id)
+        if row_id in seen:
+            print(f"!! Duplicate id {row_id!r} on row {number}, skipping.")
+            continue
+        seen.add(row_id)
+        fields = {key: value for key, value in record.items() if key not in (question_field, id_field)}
+        rows.append({"id": row_id, "question": question, "fields": fields})
+    return rows
+
+def load_completed(path):
+    # Answers are appended one JSON line at a time, so a crash can only tear the last line
+    completed, versions, good_offset = set(), Counter(), 0
+    if not os.path.exists(path):
+        return completed, versions
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                # A record is only complete once its newline is written
+                if not line.endswith(b"\n"):
+                    raise ValueError("unterminated line")
+                record = json.loads(line)
+            except ValueError:
+                break
+            completed.add(record["id"])
+            versions[record.get("index_version")] += 1
+            good_offset += len(line)
+    if good_offset < os.path.getsize(path):
+        print(f"!! Discarding a partial line at the end of {path}")
+        with open(path, "r+b") as f:
+            f.truncate(good_offset)
+    return completed, versions
+
+
+class CheckpointWriter:
+    def __init__(self, path, append=True):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, "a" if append else "w", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def checkpoint(self):
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.checkpoint()
+        self.file.close()
+
+
+def translate_queries(questions, languages):
+    queries = list(questions)
+    for language in set(languages) - {"en"}:
+        positions = [i for i, lang in enumerate(languages) if lang == language]
+        for i, translated in zip(positions, app.translate_texts([questions[i] for i in positions], translation_source(language), "en")):
+            queries[i] = translated
+    return queries
+
+def embed_queries(state, provider, queries, workers, scope=None):
+    if state["embedding_provider"] != provider.name:
+        print(app.embedding_mismatch_message(state, provider) + " Using lexical search only.")
+        return [None] * len(queries)
+    with span("embed", provider=provider.name, queries=len(queries)):
+        embeddings = generate_embeddings(queries, workers, provider)
+    if not embeddings:
+        return [None] * len(queries)
+    embedded = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+    vector_ids = [None] * len(queries)
+    if embedded:
+        # One search over the whole query matrix instead of a call per question
+        with span("vector", queries=len(embedded)):
+            matrix = np.vstack([embeddings[i] for i in embedded]).astype(np.float32)
+            for i, ids in zip(embedded, app.vector_search_batch(state, matrix, scope)):
+                vector_ids[i] = ids
+    count("lexical_fallbacks", len(queries) - len(embedded))
+    return vector_ids
+
+def complete_with_retries(messages, max_retries=BATCH_MAX_RETRIES):
+    for attempt in range(max_retries + 1):
+        try:
+            return app.chat_completion(messages)
+        except RETRYABLE_CHAT_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = retry_delay(attempt, e)
+            count("retries", operation="chat", error=e.__class__.__name__)
+            time.sleep(delay)
+
+def answer_row(row, query, language, context, version, audio, writer):
+    status = "answered"
+    if not context:
+        answer, status = app.not_found_message(language), "not_found"
+    else:
+        try:
+            answer = complete_with_retries(app.build_messages(context, query))
+        except Exception as e:
+            answer, status = f"⚠️ Error generating response: {e}", "error"
+    if status == "answered" and reply_language(language) != "en":
+        answer = app.translate_answer(answer, "en", reply_language(language))
+    record = dict(row["fields"], id=row["id"], question=row["question"], language=language, answer=answer,
+                  status=status, context_chunks=len(context), index_version=version)
+    if audio and status != "error":
+        try:
+            record["audio"] = app.generate_speech(answer, reply_language(language))
+        except Exception as e:
+            # The answer is still worth keeping, and one failed voice must not stop the run
+            print(f"⚠️ Speech synthesis failed for row {row['id']!r}: {e}")
+            record["audio"], record["audio_error"] = None, str(e)
+    writer.write(record)
+    return status
+
+def answer_batch(rows, state, args, writer):
+    app.setup_tracing()
+    with trace("batch_qa", questions=len(rows), version=state["version"]):
+        scope = app.search_scope(state, {"source": args.source, "section": args.section, "language": args.chunk_language})
+        questions = [row["question"] for row in rows]
+        with span("detect"):
+            languages = [args.language or app.detect_language(question) for question in questions]
+        with span("translate_query"):
+            queries = translate_queries(questions, languages)
+        with span("lexical"):
+            lexical_ids = [app.lexical_search(state, query, scope) for query in queries]
+        vector_ids = embed_queries(state, app.get_embedding_provider(), queries, args.embedding_workers, scope)
+        with span("retrieve"):
+            contexts = [app.search_chunks(state, query, lexical_ids=lexical, vector_ids=vector, scope=scope)
+                        for query, lexical, vector in zip(queries, lexical_ids, vector_ids)]
+
+        with span("chat", concurrency=args.concurrency):
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                futures = [
+                    executor.submit(contextvars.copy_context().run, answer_row, row, query, language, context,
+                                    state["version"], args.audio, writer)
+                    for row, query, language, context in zip(rows, queries, languages, contexts)
+                ]
+                statuses = Counter(future.result() for future in futures)
+        annotate(**statuses)
+    writer.checkpoint()
+    return statuses
+
+def run(args):
+    rows = read_questions(args.input, args.question_field, args.id_field)
+    output = args.output or os.path.splitext(args.input)[0] + ".answers.jsonl"
+    completed, versions = (set(), Counter()) if args.restart else load_completed(output)
+    pending = [row for row in rows if row["id"] not in completed]
+    print(f">> {len(rows)} questions, {len(rows) - len(pending)} already answered in {output}, {len(pending)} to go")
+    if not pending:
+        return
+
+    state = app.get_knowledge_base().get()
+    if state is None:
+        print("!! Knowledge base is not loaded, run vectors.py first.")
+        sys.exit(1)
+    stale = sum(n for version, n in versions.items() if version != state["version"])
+    if stale:
+        print(f"!! {stale} existing answers were produced with a different index version than {state['version']}")
+
+    writer = CheckpointWriter(output, append=not args.restart)
+    totals = Counter()
+    started = time.monotonic()
+    try:
+        for start in range(0, len(pending), args.batch_size):
+            batch = pending[start:start + args.batch_size]
+            totals.update(answer_batch(batch, state, args, writer))
+            done = start + len(batch)
+            elapsed = max(time.monotonic() - started, 1e-6)
+            print(f"✓ Answered {done}/{len(pending)} questions ({done / elapsed:.1f} questions/s, "
+                  f"{totals['not_found']} not found, {totals['error']} errors)")
+    finally:
+        writer.close()
+    print(f"✓✓ Answers saved: {output}")
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Answer a JSONL or CSV file of questions against the knowledge base.")
+    parser.add_argument("input", help="JSONL or CSV file with one question per row")
+    parser.add_argument("-o", "--output", help="JSONL file for answers (default: <input>.answers.jsonl)")
+    parser.add_argument("--question-field", default="question")
+    parser.add_argument("--id-field", default="id", help="column identifying rows when resuming (default: row number)")
+    parser.add_argument("--language", choices=LANGUAGES, help="skip language detection and treat every question as this language")
+    parser.add_argument("--source", help="only search chunks from this PDF (file name or path)")
+    parser.add_argument("--section", help="only search chunks whose heading contains this text")
+    parser.add_argument("--chunk-language", choices=LANGUAGES, help="only search chunks written in this language")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="questions embedded and searched together per checkpoint")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="concurrent chat completions")
+    parser.add_argument("--embedding-workers", type=int, default=EMBEDDING_WORKERS)
+    parser.add_argument("--audio", action="store_true", help="synthesize speech for every answer")
+    parser.add_argument("--restart", action="store_true", help="overwrite the output instead of resuming it")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    run(parse_args(sys.argv[1:]))
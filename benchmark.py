@@ -0,0 +1,465 @@
+import os
+import io
+import sys
+import json
+import time
+import wave
+import zlib
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+
+SERVICES = ("embeddings", "chat", "translator", "speech")
+DEFAULT_LATENCY_MS = {"embeddings": 30.0, "chat": 400.0, "translator": 40.0, "speech": 150.0}
+CHAT_TOKEN_MS = 5.0
+PHASES = ("index", "retrieval", "e2e")
+REGRESSION_METRICS = {
+    "indexing": {"chunks_per_s": "higher", "pages_per_s": "higher"},
+    "get_response_from_faiss": {"qps": "higher", "p50_ms": "lower", "p95_ms": "lower", "p99_ms": "lower"},
+    "process_input": {"qps": "higher", "p50_ms": "lower", "p95_ms": "lower", "p99_ms": "lower"},
+    "memory": {"peak_rss_mb": "lower"},
+}
+
+TOPICS = [
+    "Ladki Bahin", "Jan Arogya", "Krishi Sinchan", "Shiv Bhojan", "Gharkul Awas", "Kamgar Kalyan",
+    "Shetkari Sanman", "Vidyarthi Shishyavrutti", "Mahila Udyojak", "Jalyukta Shivar", "Berojgar Bhatta",
+    "Divyang Sahayya", "Matru Vandana", "Annapurna", "Sukanya Samruddhi", "Rojgar Hami",
+]
+DISTRICTS = [
+    "Pune", "Nagpur", "Nashik", "Aurangabad", "Kolhapur", "Solapur", "Amravati", "Latur", "Satara", "Thane",
+    "Ratnagiri", "Jalgaon", "Akola", "Beed", "Nanded", "Sangli", "Wardha", "Yavatmal", "Palghar", "Raigad",
+]
+VOCABULARY = (
+    "the applicant must submit form certificate income limit annual family members eligible scheme benefit "
+    "amount rupees month bank account aadhaar linked district office collector taluka gram panchayat online "
+    "portal registration document proof residence domicile caste category women farmers students workers "
+    "disabled senior citizens widow pension subsidy loan interest rate repayment period installment direct "
+    "transfer verification officer approval rejection appeal deadline renewal year government maharashtra "
+    "department welfare health insurance hospital treatment cashless coverage premium crop irrigation water "
+    "land record ration card beneficiary list status helpline toll free number complaint grievance redressal"
+).split()
+QUESTION_TEMPLATES = [
+    "What is the eligibility for {topic} scheme?",
+    "How do I apply for {topic} in {district} district?",
+    "What documents are required for {topic}?",
+    "What is the income limit for {topic} yojana?",
+    "Where can I check {topic} beneficiary status?",
+    "How much amount is given under {topic}?",
+]
+
+
+def sleep_ms(milliseconds, jitter=0.2):
+    if milliseconds > 0:
+        time.sleep(milliseconds * random.uniform(1 - jitter, 1 + jitter) / 1000)
+
+def mock_embedding(text, dim):
+    vector = np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).round(6).tolist()
+
+def mock_answer(messages, words=60):
+    prompt = messages[-1]["content"] if messages else ""
+    context_words = [word for word in prompt.split() if word.isalpha()] or VOCABULARY
+    rng = random.Random(zlib.crc32(prompt.encode("utf-8")))
+    sentences, sentence = [], []
+    for _ in range(words):
+        sentence.append(rng.choice(context_words))
+        if len(sentence) >= rng.randint(8, 14):
+            sentences.append(" ".join(sentence).capitalize() + ".")
+            sentence = []
+    if sentence:
+        sentences.append(" ".join(sentence).capitalize() + ".")
+    return " ".join(sentences)
+
+def silent_wav(duration_seconds, rate=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(b"\0\0" * int(rate * duration_seconds))
+    return buffer.getvalue()
+
+
+class MockAzureServer:
+    def __init__(self, latency_ms=None, error_rates=None, dim=1536, host="127.0.0.1", port=0):
+        self.latency_ms = dict(DEFAULT_LATENCY_MS, **(latency_ms or {}))
+        self.error_rates = {service: 0.0 for service in SERVICES}
+        self.error_rates.update(error_rates or {})
+        self.dim = dim
+        self.requests = {service: 0 for service in SERVICES}
+        self.errors = {service: 0 for service in SERVICES}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        with self.lock:
+            return {"requests": dict(self.requests), "errors": dict(self.errors)}
+
+    def handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if status == 503:
+                    self.send_header("Retry-After", "0.1")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                if url.path.endswith("/embeddings"):
+                    service = "embeddings"
+                elif url.path.endswith("/chat/completions"):
+                    service = "chat"
+                elif url.path.endswith("/translate"):
+                    service = "translator"
+                elif url.path.endswith("/cognitiveservices/v1"):
+                    service = "speech"
+                else:
+                    self.send_json(404, {"error": {"message": f"unknown path {url.path}"}})
+                    return
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                with mock.lock:
+                    mock.requests[service] += 1
+                    failed = random.random() < mock.error_rates[service]
+                    if failed:
+                        mock.errors[service] += 1
+                sleep_ms(mock.latency_ms[service])
+                if failed:
+                    self.send_json(503, {"error": {"message": "Injected failure", "type": "server_error", "code": "503"}})
+                    return
+                getattr(self, f"handle_{service}")(url, body)
+
+            def handle_embeddings(self, url, body):
+                texts = json.loads(body)["input"]
+                texts = [texts] if isinstance(texts, str) else texts
+                self.send_json(200, {
+                    "object": "list",
+                    "model": "mock-embeddings",
+                    "data": [{"object": "embedding", "index": i, "embedding": mock_embedding(text, mock.dim)}
+                             for i, text in enumerate(texts)],
+                    "usage": {"prompt_tokens": sum(len(t.split()) for t in texts), "total_tokens": sum(len(t.split()) for t in texts)},
+                })
+
+            def handle_chat(self, url, body):
+                request = json.loads(body)
+                answer = mock_answer(request.get("messages", []))
+                if not request.get("stream"):
+                    self.send_json(200, {
+                        "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": "mock-chat",
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                        "usage": {"prompt_tokens": len(json.dumps(request.get("messages", []))) // 4,
+                                  "completion_tokens": len(answer.split()), "total_tokens": 0},
+                    })
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                for i, word in enumerate(answer.split(" ")):
+                    event = {"id": "mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": "mock-chat",
+                             "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    sleep_ms(CHAT_TOKEN_MS)
+                self.wfile.write(b"data: [DONE]\n\n")
+
+            def handle_translator(self, url, body):
+                request = json.loads(body)
+                if isinstance(request, dict):
+                    texts, to = request.get("contents", []), request.get("to", ["hi"])
+                else:
+                    texts, to = [item.get("text", item.get("Text", "")) for item in request], parse_qs(url.query).get("to", ["hi"])
+                self.send_json(200, [{"translations": [{"text": f"[{to[0]}] {text}", "to": to[0]}]} for text in texts])
+
+            def handle_speech(self, url, body):
+                audio = silent_wav(min(30.0, 0.06 * len(body.decode("utf-8", "replace"))))
+                self.send_response(200)
+                self.send_header("Content-Type", "audio/wav")
+                self.send_header("Content-Length", str(len(audio)))
+                self.end_headers()
+                self.wfile.write(audio)
+
+        return Handler
+
+
+class MockSynthesizerPool:
+    # Stands in for tts.SynthesizerPool: the Speech SDK talks its own websocket protocol
+    def __init__(self, url):
+        self.url = url.rstrip("/") + "/cognitiveservices/v1"
+
+    def speak(self, voice, text):
+        request = urllib.request.Request(self.url, data=text.encode("utf-8"), headers={"X-Voice": voice}, method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                return response.read()
+        except Exception as e:
+            print(f"⚠️ Speech synthesis error: {e}")
+            return None
+
+
+def build_synthetic_corpus(directory, documents=4, pages=50, seed=0):
+    import fitz
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+    headings = []
+    for document in range(documents):
+        doc = fitz.open()
+        for page_number in range(pages):
+            page = doc.new_page()
+            y = 50
+            for section in range(2):
+                topic = rng.choice(TOPICS)
+                heading = f"{topic} Yojana {document + 1}.{page_number + 1}.{section + 1} - {rng.choice(DISTRICTS)}"
+                headings.append((topic, heading))
+                # insert_textbox draws nothing and returns a negative value when the text does not fit
+                assert page.insert_textbox(fitz.Rect(50, y, 545, y + 30), heading, fontsize=16) >= 0, heading
+                y += 36
+                for _ in range(3):
+                    words = rng.choices(VOCABULARY, weights, k=rng.randint(50, 70))
+                    words[rng.randrange(len(words))] = topic
+                    assert page.insert_textbox(fitz.Rect(50, y, 545, y + 100), " ".join(words).capitalize() + ".", fontsize=10) >= 0
+                    y += 110
+        doc.save(os.path.join(directory, f"synthetic_{document + 1:03d}.pdf"))
+        doc.close()
+    return headings
+
+def synthetic_queries(count, headings=None, seed=1):
+    rng = random.Random(seed)
+    topics = sorted({topic for topic, _ in headings}) if headings else TOPICS
+    return [rng.choice(QUESTION_TEMPLATES).format(topic=rng.choice(topics), district=rng.choice(DISTRICTS))
+            for _ in range(count)]
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+    scale = 1 / 2 ** 20 if sys.platform == "darwin" else 1 / 2 ** 10
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+def summarize_latencies(latencies, errors, wall_seconds):
+    latencies = np.array(latencies) * 1000
+    return {
+        "requests": int(len(latencies)),
+        "errors": errors,
+        "qps": len(latencies) / wall_seconds if wall_seconds else 0.0,
+        "mean_ms": float(latencies.mean()) if len(latencies) else None,
+        "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+        "p95_ms": float(np.percentile(latencies, 95)) if len(latencies) else None,
+        "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+        "wall_seconds": wall_seconds,
+    }
+
+def run_load(name, call, queries, concurrency):
+    print(f">> {name}: {len(queries)} requests at concurrency {concurrency}...")
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def run(i, query):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            result = call(i, query)
+            failed = isinstance(result, str) and result.startswith("⚠️")
+        except Exception as e:
+            print(f"!! {name} request failed: {e!r}")
+            failed = True
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            errors += failed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run, range(len(queries)), queries))
+    summary = summarize_latencies(latencies, errors, time.perf_counter() - started)
+    print(f"✓ {name}: {summary['qps']:.1f} QPS, p50 {summary['p50_ms']:.0f} ms, "
+          f"p95 {summary['p95_ms']:.0f} ms, p99 {summary['p99_ms']:.0f} ms, {errors} errors")
+    return summary
+
+def bench_indexing(vectors, corpus_dir, workers, index_type):
+    import fitz
+    paths = vectors.resolve_pdf_paths([corpus_dir])
+    pages = 0
+    for path in paths:
+        with fitz.open(path) as doc:
+            pages += doc.page_count
+    started = time.perf_counter()
+    if not vectors.main([corpus_dir], workers, index_type):
+        print("!! Indexing failed, no indexing results recorded.")
+        return None
+    seconds = time.perf_counter() - started
+    from chunk_store import current_index_dir
+    with open(os.path.join(current_index_dir(vectors.INDEX_DIR), vectors.MANIFEST_FILE), "r", encoding="utf-8") as f:
+        chunks = len(json.load(f)["chunks"])
+    result = {"documents": len(paths), "pages": pages, "chunks": chunks, "seconds": seconds,
+              "pages_per_s": pages / seconds, "chunks_per_s": chunks / seconds, "index_type": index_type}
+    print(f"✓ Indexed {pages} pages into {chunks} chunks in {seconds:.1f}s ({result['chunks_per_s']:.1f} chunks/s)")
+    return result
+
+def compare_results(results, baseline, tolerance):
+    regressions = []
+    print(f"{'metric':<40} {'baseline':>12} {'current':>12} {'change':>9}")
+    for section, metrics in REGRESSION_METRICS.items():
+        for metric, better in metrics.items():
+            old = (baseline.get(section) or {}).get(metric)
+            new = (results.get(section) or {}).get(metric)
+            if old is None or new is None or old == 0:
+                continue
+            change = (new - old) / old
+            worse = change < -tolerance if better == "higher" else change > tolerance
+            flag = "  !!" if worse else ""
+            print(f"{section + '.' + metric:<40} {old:>12.2f} {new:>12.2f} {change:>+8.1%}{flag}")
+            if worse:
+                regressions.append(f"{section}.{metric}")
+    return regressions
+
+def parse_service_values(values, default):
+    parsed = {}
+    for value in values or []:
+        service, _, number = value.partition("=")
+        if service not in SERVICES or not number:
+            raise argparse.ArgumentTypeError(f"expected SERVICE=NUMBER with SERVICE in {', '.join(SERVICES)}, got {value!r}")
+        parsed[service] = float(number)
+    return dict(default, **parsed)
+
+def configure_environment(url, workdir, args):
+    # Point every Azure client at the mock server before main/vectors read their configuration
+    os.environ.update({
+        "AZURE_OPENAI_ENDPOINT": url + "/",
+        "AZURE_OPENAI_API_KEY": "mock",
+        "AZURE_OPENAI_API_VERSION": "2023-05-15",
+        "AZURE_OPENAI_DEPLOYMENT": "mock-chat",
+        "AZURE_DEPLOYMENT_EMBEDDINGS": "mock-embeddings",
+        "AZURE_TRANSLATOR_KEY": "mock",
+        "AZURE_TRANSLATOR_REGION": "local",
+        "AZURE_TRANSLATOR_ENDPOINT": url + "/",
+        "AZURE_SPEECH_KEY": "mock",
+        "AZURE_SPEECH_REGION": "local",
+        "EMBEDDING_PROVIDER": "azure",
+        "SPEECH_OUTPUT_FORMAT": "wav",
+        "RERANK_MODEL": args.rerank_model,
+        "TRACE_LOG_PATH": os.path.join(workdir, "logs", "traces.jsonl"),
+    })
+    os.environ.setdefault("EMBEDDING_TOKENS_PER_MINUTE", str(10 ** 9))
+    os.environ.setdefault("EMBEDDING_REQUESTS_PER_MINUTE", str(10 ** 9))
+
+def run_benchmark(args):
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="benchmark-"))
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    print(f">> Working directory: {workdir}")
+
+    latency = parse_service_values(args.latency_ms, DEFAULT_LATENCY_MS)
+    error_rates = parse_service_values(args.error_rate, {})
+    server = MockAzureServer(latency, error_rates, args.dim).start()
+    print(f"✓ Mock Azure services listening on {server.url}")
+    configure_environment(server.url, workdir, args)
+
+    import vectors
+    import main as app
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count()},
+    }
+    corpus_dir = os.path.join(workdir, "corpus")
+    headings = None
+    if "index" in args.phases:
+        print(f">> Building synthetic corpus: {args.documents} documents x {args.pages} pages...")
+        headings = build_synthetic_corpus(corpus_dir, args.documents, args.pages, args.seed)
+        results["indexing"] = bench_indexing(vectors, corpus_dir, args.workers, args.index_type)
+
+    knowledge_base = app.get_knowledge_base()
+    if ("retrieval" in args.phases or "e2e" in args.phases) and knowledge_base.get() is None:
+        print("!! No index in the working directory, run the index phase first.")
+        server.stop()
+        return results
+    app.get_speech_service().pool = MockSynthesizerPool(server.url)
+
+    if "retrieval" in args.phases:
+        queries = synthetic_queries(args.queries, headings, args.seed + 1)
+        results["get_response_from_faiss"] = run_load(
+            "get_response_from_faiss",
+            lambda i, query: app.get_response_from_faiss(query, "en", knowledge_base, f"bench-retrieval-{i}"),
+            queries, args.concurrency,
+        )
+    if "e2e" in args.phases:
+        queries = synthetic_queries(args.queries, headings, args.seed + 2)
+        results["process_input"] = run_load(
+            "process_input",
+            lambda i, query: app.process_input(query, knowledge_base, f"bench-e2e-{i}")[0],
+            queries, args.concurrency,
+        )
+
+    rss, children_rss = peak_rss_mb()
+    results["memory"] = {"peak_rss_mb": rss, "children_peak_rss_mb": children_rss}
+    results["mock"] = server.stats()
+    server.stop()
+    return results
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark indexing and answering against local mock Azure services.")
+    parser.add_argument("--phases", nargs="+", choices=PHASES, default=list(PHASES))
+    parser.add_argument("--workdir", help="directory for the corpus, index and caches (default: a new temp dir)")
+    parser.add_argument("--documents", type=int, default=4, help="synthetic PDFs to generate")
+    parser.add_argument("--pages", type=int, default=50, help="pages per synthetic PDF")
+    parser.add_argument("--queries", type=int, default=200, help="requests per load phase")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="indexing worker processes")
+    parser.add_argument("--index-type", default=os.getenv("FAISS_INDEX_TYPE", "flat"))
+    parser.add_argument("--dim", type=int, default=1536, help="dimension of mock embeddings")
+    parser.add_argument("--latency-ms", nargs="*", metavar="SERVICE=MS", help="injected latency per service")
+    parser.add_argument("--error-rate", nargs="*", metavar="SERVICE=P", help="injected failure probability per service")
+    parser.add_argument("--rerank-model", default="", help="cross-encoder to load (default: re-ranking disabled)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against a previous JSON result")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="relative change treated as a regression")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    results = run_benchmark(args)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"✓ Results saved: {output}")
+    if baseline:
+        regressions = compare_results(results, baseline, args.tolerance)
+        if regressions:
+            print(f"!! Regressions beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
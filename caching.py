@@ -0,0 +1,205 @@
+import re
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class LRUCache:
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > time.monotonic()):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl if ttl else None, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+class PersistentLRUCache:
+    def __init__(self, path, max_size=100000, memory_size=4096):
+        self.path = path
+        self.max_size = max_size
+        self.memory = LRUCache(memory_size)
+        self.local = threading.local()
+        self.writes = 0
+        with self.connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, used REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS cache_used ON cache (used)")
+
+    def connect(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            self.local.db = db
+        return db
+
+    def get(self, key, default=None):
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        try:
+            with self.connect() as db:
+                row = db.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return default
+                db.execute("UPDATE cache SET used = ? WHERE key = ?", (time.time(), key))
+        except sqlite3.Error as e:
+            print(f"⚠️ Cache read failed: {e}")
+            return default
+        self.memory.set(key, row[0])
+        return row[0]
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        try:
+            with self.connect() as db:
+                db.execute("INSERT OR REPLACE INTO cache (key, value, used) VALUES (?, ?, ?)", (key, value, time.time()))
+                self.writes += 1
+                if self.writes % 100 == 0:
+                    db.execute(
+                        "DELETE FROM cache WHERE key NOT IN (SELECT key FROM cache ORDER BY used DESC LIMIT ?)",
+                        (self.max_size,),
+                    )
+        except sqlite3.Error as e:
+            print(f"⚠️ Cache write failed: {e}")
+
+    def stats(self):
+        return self.memory.stats()
+
+
+class SemanticCache:
+    def __init__(self, max_size=1024, threshold=0.95, ttl=None):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.ttl = ttl
+        self.index = None
+        self.entries = OrderedDict()
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def normalize(self, embedding):
+        vector = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, embedding):
+        vector = self.normalize(embedding)
+        with self.lock:
+            if self.index is not None and self.index.ntotal and self.index.d == vector.shape[1]:
+                scores, ids = self.index.search(vector, 1)
+                entry_id = int(ids[0][0])
+                entry = self.entries.get(entry_id)
+                if entry is not None and scores[0][0] >= self.threshold:
+                    if entry[0] is None or entry[0] > time.monotonic():
+                        self.entries.move_to_end(entry_id)
+                        self.hits += 1
+                        return entry[1]
+                    self.remove(entry_id)
+            self.misses += 1
+            return None
+
+    def set(self, embedding, value):
+        import faiss
+        vector = self.normalize(embedding)
+        with self.lock:
+            if self.index is None or self.index.d != vector.shape[1]:
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+                self.entries.clear()
+            entry_id = self.next_id
+            self.next_id += 1
+            self.index.add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+            self.entries[entry_id] = (time.monotonic() + self.ttl if self.ttl else None, value)
+            while len(self.entries) > self.max_size:
+                self.remove(next(iter(self.entries)))
+
+    def remove(self, entry_id):
+        self.entries.pop(entry_id, None)
+        self.index.remove_ids(np.array([entry_id], dtype=np.int64))
+
+    def clear(self):
+        with self.lock:
+            self.index = None
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+def normalize_query(text):
+    return re.sub(r"\s+", " ", text).strip().strip("?.!।").strip().casefold()
+
+
+class QueryCache:
+    def __init__(self, max_size=1024, ttl=None, semantic_max_size=1024, semantic_threshold=0.95):
+        self.exact = LRUCache(max_size, ttl)
+        self.semantic = SemanticCache(semantic_max_size, semantic_threshold, ttl)
+        self.version = None
+        self.lock = threading.Lock()
+
+    def check_version(self, version):
+        with self.lock:
+            if version != self.version:
+                self.exact.clear()
+                self.semantic.clear()
+                self.version = version
+
+    def key(self, query, scope=()):
+        return (normalize_query(query), scope) if scope else normalize_query(query)
+
+    def get_exact(self, query, version, scope=()):
+        self.check_version(version)
+        return self.exact.get(self.key(query, scope))
+
+    def get_semantic(self, embedding, version, scope=()):
+        self.check_version(version)
+        # Similar questions restricted to different documents or asked in different conversations have different answers
+        if scope:
+            return None
+        return self.semantic.get(embedding)
+
+    def set(self, query, embedding, value, version, scope=()):
+        if version != self.version:
+            return
+        self.exact.set(self.key(query, scope), value)
+        if embedding is not None and not scope:
+            self.semantic.set(embedding, value)
+
+    def stats(self):
+        return {"version": self.version, "exact": self.exact.stats(), "semantic": self.semantic.stats()}
@@ -0,0 +1,212 @@
+import os
+import shutil
+import datetime
+import numpy as np
+
+CHUNK_TEXT_FILE = "chunks.bin"
+CHUNK_OFFSETS_FILE = "chunk_offsets.npy"
+CHUNK_IDS_FILE = "chunk_ids.npy"
+EMBEDDINGS_FILE = "embeddings.npy"
+INDEX_VERSION_FILE = "index_version.txt"
+CHUNK_METADATA_FILE = "chunk_metadata.npz"
+INDEX_POINTER_FILE = "CURRENT"
+STAGING_PREFIX = ".staging-"
+METADATA_TEXT_FIELDS = ("source", "heading", "language")
+METADATA_PAGE_FIELDS = ("page_start", "page_end")
+
+
+def chunk_store_exists(directory="."):
+    return all(os.path.exists(os.path.join(directory, name))
+               for name in (CHUNK_TEXT_FILE, CHUNK_OFFSETS_FILE, CHUNK_IDS_FILE, EMBEDDINGS_FILE))
+
+def read_index_version(directory="."):
+    try:
+        with open(os.path.join(directory, INDEX_VERSION_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+def new_index_version():
+    return datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
+
+def write_index_version(directory=".", version=None):
+    version = version or new_index_version()
+    path = os.path.join(directory, INDEX_VERSION_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(path + ".tmp", path)
+    return version
+
+def current_index_dir(root):
+    # Each build is published to its own directory under root and CURRENT names the live one
+    try:
+        with open(os.path.join(root, INDEX_POINTER_FILE), "r", encoding="utf-8") as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        name = ""
+    # Indexes built before versioned directories live in the working directory
+    return os.path.join(root, name) if name else "."
+
+def fsync_directory(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def staging_index_dir(root, version):
+    os.makedirs(root, exist_ok=True)
+    for name in os.listdir(root):
+        if name.startswith(STAGING_PREFIX):
+            print(f"!! Removing unfinished build {name}")
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    path = os.path.join(root, STAGING_PREFIX + version)
+    os.makedirs(path)
+    return path
+
+def publish_index_dir(staging, root, version):
+    for name in os.listdir(staging):
+        with open(os.path.join(staging, name), "rb") as f:
+            os.fsync(f.fileno())
+    fsync_directory(staging)
+    directory = os.path.join(root, version)
+    os.rename(staging, directory)
+    pointer = os.path.join(root, INDEX_POINTER_FILE)
+    with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    # Readers resolve the pointer once, so they see the old build or the new one but never a mix
+    os.replace(pointer + ".tmp", pointer)
+    fsync_directory(root)
+    return directory
+
+def prune_index_dirs(root, keep):
+    current = os.path.basename(current_index_dir(root))
+    versions = sorted(name for name in os.listdir(root)
+                      if os.path.isdir(os.path.join(root, name)) and not name.startswith(STAGING_PREFIX))
+    for name in versions[:-max(1, keep)]:
+        if name != current:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+def save_array(path, array):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+def write_chunk_metadata(ids, metadata, directory="."):
+    # One column per field in chunk ID order; strings are stored once and referenced by code
+    columns = {}
+    for field in METADATA_TEXT_FIELDS:
+        values = np.array([metadata.get(int(chunk_id), {}).get(field) or "" for chunk_id in ids], dtype=str)
+        columns[f"{field}_values"], codes = np.unique(values, return_inverse=True)
+        columns[field] = codes.astype(np.int32)
+    for field in METADATA_PAGE_FIELDS:
+        columns[field] = np.array([metadata.get(int(chunk_id), {}).get(field) or 0 for chunk_id in ids], dtype=np.int32)
+    path = os.path.join(directory, CHUNK_METADATA_FILE)
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, **columns)
+    os.replace(path + ".tmp", path)
+
+def write_chunk_store(chunk_store, embedding_store, directory=".", metadata=None):
+    ids = np.array(sorted(chunk_store), dtype=np.int64)
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    text_path = os.path.join(directory, CHUNK_TEXT_FILE)
+    with open(text_path + ".tmp", "wb") as f:
+        position = 0
+        for row, chunk_id in enumerate(ids):
+            data = chunk_store[int(chunk_id)].encode("utf-8")
+            f.write(data)
+            position += len(data)
+            offsets[row + 1] = position
+    os.replace(text_path + ".tmp", text_path)
+
+    if len(ids):
+        embeddings = np.stack([np.asarray(embedding_store[int(chunk_id)], dtype=np.float32) for chunk_id in ids])
+    else:
+        embeddings = np.zeros((0, 0), dtype=np.float32)
+    save_array(os.path.join(directory, CHUNK_OFFSETS_FILE), offsets)
+    save_array(os.path.join(directory, EMBEDDINGS_FILE), embeddings)
+    if metadata is not None:
+        write_chunk_metadata(ids, metadata, directory)
+    save_array(os.path.join(directory, CHUNK_IDS_FILE), ids)
+
+
+class ChunkMetadata:
+    def __init__(self, ids, path):
+        self.ids = ids
+        with np.load(path) as data:
+            self.columns = {name: data[name] for name in data.files}
+        if len(self.columns["source"]) != len(ids):
+            raise ValueError(f"{path} has {len(self.columns['source'])} rows for {len(ids)} chunks")
+
+    def values(self, field):
+        return [str(value) for value in self.columns[f"{field}_values"] if value]
+
+    def matching(self, field, predicate):
+        # Filters are evaluated once per distinct value, then applied to the code column
+        codes = [code for code, value in enumerate(self.columns[f"{field}_values"]) if value and predicate(str(value))]
+        return np.isin(self.columns[field], codes)
+
+    def select(self, source=None, section=None, language=None):
+        mask = np.ones(len(self.ids), dtype=bool)
+        if source:
+            mask &= self.matching("source", lambda value: source in (value, os.path.basename(value)))
+        if section:
+            section = section.casefold()
+            mask &= self.matching("heading", lambda value: section in value.casefold())
+        if language:
+            mask &= self.matching("language", lambda value: value == language)
+        return np.asarray(self.ids[mask], dtype=np.int64)
+
+
+class ChunkStore:
+    def __init__(self, directory="."):
+        self.directory = directory
+        self.ids = np.load(os.path.join(directory, CHUNK_IDS_FILE), mmap_mode="r")
+        self.offsets = np.load(os.path.join(directory, CHUNK_OFFSETS_FILE), mmap_mode="r")
+        self.embeddings = np.load(os.path.join(directory, EMBEDDINGS_FILE), mmap_mode="r")
+        text_path = os.path.join(directory, CHUNK_TEXT_FILE)
+        if os.path.getsize(text_path):
+            self.text = np.memmap(text_path, dtype=np.uint8, mode="r")
+        else:
+            self.text = np.zeros(0, dtype=np.uint8)
+        metadata_path = os.path.join(directory, CHUNK_METADATA_FILE)
+        # Stores written before metadata was recorded cannot be filtered
+        self.metadata = ChunkMetadata(self.ids, metadata_path) if os.path.exists(metadata_path) else None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, chunk_id):
+        row = int(np.searchsorted(self.ids, chunk_id))
+        if row < len(self.ids) and self.ids[row] == chunk_id:
+            return row
+        return None
+
+    def __contains__(self, chunk_id):
+        return self.row(chunk_id) is not None
+
+    def __getitem__(self, chunk_id):
+        row = self.row(chunk_id)
+        if row is None:
+            raise KeyError(chunk_id)
+        return self.text_at(row)
+
+    def get(self, chunk_id, default=None):
+        row = self.row(chunk_id)
+        return default if row is None else self.text_at(row)
+
+    def text_at(self, row):
+        return self.text[self.offsets[row]:self.offsets[row + 1]].tobytes().decode("utf-8")
+
+    def embedding(self, chunk_id):
+        row = self.row(chunk_id)
+        if row is None:
+            raise KeyError(chunk_id)
+        return self.embeddings[row]
+
+    def items(self):
+        for row, chunk_id in enumerate(self.ids):
+            yield int(chunk_id), self.text_at(row)
@@ -0,0 +1,98 @@
+import os
+import json
+import requests
+
+QA_CLIENT_TIMEOUT_SECONDS = float(os.getenv("QA_CLIENT_TIMEOUT_SECONDS", "120"))
+REMOTE_AUDIO_DIR = os.getenv("REMOTE_AUDIO_DIR", os.path.join("output", "remote_audio"))
+BUSY_MESSAGE = "⚠️ The service is busy, please try again in a moment."
+
+
+class QAClient:
+    def __init__(self, base_url, timeout=QA_CLIENT_TIMEOUT_SECONDS, audio_dir=REMOTE_AUDIO_DIR, public_url=""):
+        self.base_url = base_url.rstrip("/")
+        self.public_url = public_url.rstrip("/")
+        self.timeout = timeout
+        self.audio_dir = audio_dir
+        self.session = requests.Session()
+
+    def post(self, path, input_text_or_file, session_id, stream=False, filters=None):
+        if os.path.isfile(input_text_or_file):
+            with open(input_text_or_file, "rb") as f:
+                return self.session.post(
+                    self.base_url + path, files={"audio": (os.path.basename(input_text_or_file), f)},
+                    data={"session_id": session_id or "", "filters": json.dumps(filters) if filters else ""},
+                    stream=stream, timeout=self.timeout
+                )
+        return self.session.post(self.base_url + path, json={"query": input_text_or_file, "session_id": session_id, "filters": filters},
+                                 stream=stream, timeout=self.timeout)
+
+    def download_audio(self, url):
+        if not url:
+            return None
+        if self.public_url:
+            # Browsers fetch the audio from the server themselves, so it is never copied locally
+            return self.public_url + url
+        # Server audio names are content hashes, so a local copy never goes stale
+        path = os.path.join(self.audio_dir, os.path.basename(url))
+        if os.path.exists(path):
+            return path
+        try:
+            response = self.session.get(self.base_url + url, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f"⚠️ Could not fetch audio {url}: {e}")
+            return None
+        os.makedirs(self.audio_dir, exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(response.content)
+        os.replace(path + ".tmp", path)
+        return path
+
+    def process_input(self, input_text_or_file, knowledge_base=None, session_id=None, filters=None):
+        try:
+            response = self.post("/v1/answer", input_text_or_file, session_id, filters=filters)
+            if response.status_code == 503:
+                return BUSY_MESSAGE, None
+            response.raise_for_status()
+        except requests.RequestException as e:
+            return f"⚠️ Error contacting the answering service: {e}", None
+        data = response.json()
+        return data["answer"], self.download_audio(data.get("audio_url"))
+
+    def process_input_streaming(self, input_text_or_file, knowledge_base=None, session_id=None, filters=None):
+        try:
+            response = self.post("/v1/stream", input_text_or_file, session_id, stream=True, filters=filters)
+            if response.status_code == 503:
+                yield ("done", BUSY_MESSAGE, None)
+                return
+            response.raise_for_status()
+        except requests.RequestException as e:
+            yield ("done", f"⚠️ Error contacting the answering service: {e}", None)
+            return
+        with response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event["type"] in ("sentence", "done"):
+                    yield (event["type"], event["text"], self.download_audio(event.get("audio_url")))
+                else:
+                    yield (event["type"], event["text"])
+
+    def sources(self):
+        try:
+            return self.session.get(self.base_url + "/v1/sources", timeout=self.timeout).json()["sources"]
+        except (requests.RequestException, ValueError, KeyError):
+            return []
+
+    def recent_traces(self):
+        try:
+            return self.session.get(self.base_url + "/v1/traces", timeout=self.timeout).json()
+        except (requests.RequestException, ValueError):
+            return []
+
+    def render_metrics(self):
+        try:
+            return self.session.get(self.base_url + "/metrics", timeout=self.timeout).text
+        except requests.RequestException as e:
+            return f"# metrics unavailable: {e}\n"
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+import numpy as np
+
+EMBEDDING_PROVIDERS = ("azure", "local")
+# int8 dynamically quantized export shipped with the sentence-transformers hub models
+QUANTIZED_ONNX_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+
+
+def normalize_embeddings(embeddings):
+    # Unit-length vectors make inner product equal cosine similarity
+    matrix = np.array(embeddings, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1.0)
+
+
+class AzureEmbeddingProvider:
+    kind = "azure"
+
+    def __init__(self, deployment):
+        self.deployment = deployment
+        self.name = f"azure:{deployment}"
+
+    def warm_up(self):
+        pass
+
+    def embed(self, texts, timeout=None):
+        import openai
+        response = openai.Embedding.create(deployment_id=self.deployment, input=texts, request_timeout=timeout)
+        data = sorted(response["data"], key=lambda item: item["index"])
+        return np.array([item["embedding"] for item in data], dtype=np.float32)
+
+    async def aembed(self, texts):
+        import openai
+        response = await openai.Embedding.acreate(deployment_id=self.deployment, input=texts)
+        data = sorted(response["data"], key=lambda item: item["index"])
+        return np.array([item["embedding"] for item in data], dtype=np.float32)
+
+
+class SentenceTransformerProvider:
+    kind = "local"
+
+    def __init__(self, model_name, backend="torch", quantize=False, batch_size=32, device="cpu"):
+        self.model_name = model_name
+        self.name = f"local:{model_name}"
+        self.backend = backend
+        self.quantize = quantize
+        self.batch_size = batch_size
+        self.device = device
+        self.model = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.model is None:
+            with self.lock:
+                if self.model is None:
+                    from sentence_transformers import SentenceTransformer
+                    model = None
+                    if self.quantize and self.backend != "onnx":
+                        print(f"⚠️ Quantized embeddings need the onnx backend, loading {self.model_name} unquantized on {self.backend}.")
+                    elif self.quantize:
+                        try:
+                            model = SentenceTransformer(self.model_name, device=self.device, backend=self.backend,
+                                                        model_kwargs={"file_name": QUANTIZED_ONNX_FILE})
+                        except Exception as e:
+                            # Not every hub model ships the quantized export
+                            print(f"⚠️ No quantized export {QUANTIZED_ONNX_FILE} for {self.model_name}, loading it unquantized: {e}")
+                    if model is None:
+                        model = SentenceTransformer(self.model_name, device=self.device, backend=self.backend)
+                    model.encode(["warm-up"], batch_size=1)
+                    self.model = model
+        return self.model
+
+    def warm_up(self):
+        self.load()
+
+    def embed(self, texts, timeout=None):
+        # Unit-length vectors, like Azure's embeddings
+        return self.load().encode(
+            list(texts), batch_size=self.batch_size, convert_to_numpy=True, normalize_embeddings=True
+        ).astype(np.float32)
+
+    async def aembed(self, texts):
+        return await asyncio.to_thread(self.embed, texts)
+
+
+def create_embedding_provider(provider="azure", azure_deployment=None, local_model=None, local_backend="torch",
+                              local_quantize=False, local_batch_size=32):
+    if provider == "azure":
+        return AzureEmbeddingProvider(azure_deployment)
+    if provider == "local":
+        return SentenceTransformerProvider(local_model, local_backend, local_quantize, local_batch_size)
+    raise ValueError(f"Unknown embedding provider {provider!r}, expected one of {', '.join(EMBEDDING_PROVIDERS)}")
@@ -0,0 +1,137 @@
+import threading
+import numpy as np
+from caching import LRUCache, normalize_query
+from lexical import tokenize
+
+LANGUAGES = ("en", "hi", "mr", "hi-en")
+# Romanized Hindi has no translator source code of its own, so the translator auto-detects it
+TRANSLATION_SOURCES = {"en": "en", "hi": "hi", "mr": "mr", "hi-en": None}
+REPLY_LANGUAGES = {"en": "en", "hi": "hi", "mr": "mr", "hi-en": "hi"}
+
+HINDI_WORDS = {
+    "है", "हैं", "था", "थी", "थे", "और", "का", "की", "के", "में", "से", "को", "क्या", "कैसे", "नहीं", "लिए",
+    "मुझे", "मेरा", "मेरी", "हम", "आप", "यह", "वह", "कौन", "कितना", "कितने", "चाहिए", "होगा", "मिलेगा",
+    "बताइए", "बताओ", "करें", "करना", "भी", "पर", "एक", "किस", "कहाँ", "कब",
+}
+MARATHI_WORDS = {
+    "आहे", "आहेत", "आणि", "काय", "कसे", "कशी", "कसा", "मला", "माझा", "माझी", "माझे", "आम्ही", "तुम्ही",
+    "हे", "नाही", "साठी", "मध्ये", "पाहिजे", "किती", "कोण", "कुठे", "करावे", "करायचे", "मिळेल", "सांगा",
+    "होईल", "कधी", "कोणती", "कोणते", "व",
+}
+MARATHI_SUFFIXES = ("च्या", "साठी", "मध्ये", "ांना")
+MARATHI_LETTERS = ("ळ",)
+ROMAN_HINDI_WORDS = {
+    "hai", "hain", "kya", "kaise", "kaisa", "kaun", "kab", "kahan", "kitna", "kitne", "kitni", "mujhe", "mera",
+    "meri", "mere", "hum", "aap", "apna", "nahi", "nahin", "nhi", "ke", "ki", "ka", "ko", "se", "mein", "liye",
+    "lie", "aur", "bhi", "chahiye", "milega", "milegi", "milta", "batao", "bataiye", "bataye", "karna", "karein",
+    "kare", "hoga", "hogi", "tha", "thi", "yeh", "woh", "kuch", "sakta", "sakti", "sakte", "wala", "wali",
+    "raha", "rahi", "kahaan", "kyun", "kyon",
+}
+ENGLISH_WORDS = {
+    "the", "is", "are", "was", "what", "how", "who", "when", "where", "which", "why", "for", "of", "to", "and",
+    "in", "on", "my", "me", "can", "do", "does", "an", "with", "about", "please", "get", "there", "this",
+    "that", "will", "should", "any", "have", "has", "from", "by",
+}
+
+
+def script_histogram(text):
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    # Devanagari letters and signs, without danda, digits and the abbreviation sign
+    devanagari = ((codes >= 0x0900) & (codes <= 0x0963)) | ((codes >= 0x0971) & (codes <= 0x097F)) | \
+                 ((codes >= 0xA8E0) & (codes <= 0xA8FF))
+    latin = ((codes | 0x20) >= 0x61) & ((codes | 0x20) <= 0x7A) | \
+            ((codes >= 0xC0) & (codes <= 0x24F) & (codes != 0xD7) & (codes != 0xF7))
+    other = (codes >= 0x0370) & ~devanagari & ~((codes >= 0x0900) & (codes <= 0x097F)) & \
+            ~((codes >= 0x2000) & (codes <= 0x2BFF)) & (codes < 0x1F000)
+    return {
+        "devanagari": int(np.count_nonzero(devanagari)),
+        "latin": int(np.count_nonzero(latin)),
+        "other": int(np.count_nonzero(other)),
+    }
+
+def devanagari_language(words):
+    hindi = sum(word in HINDI_WORDS for word in words)
+    marathi = sum(word in MARATHI_WORDS or word.endswith(MARATHI_SUFFIXES) or any(letter in word for letter in MARATHI_LETTERS)
+                  for word in words)
+    if hindi == marathi:
+        return None
+    return "mr" if marathi > hindi else "hi"
+
+def latin_language(words):
+    hindi = sum(word in ROMAN_HINDI_WORDS for word in words)
+    english = sum(word in ENGLISH_WORDS for word in words)
+    if hindi >= 2 and hindi > english:
+        return "hi-en"
+    if english:
+        return "en"
+    return None
+
+
+class LanguageDetector:
+    def __init__(self, model="", cache_size=4096, min_script_share=0.2, seed=0):
+        self.model_name = model
+        self.min_script_share = min_script_share
+        self.seed = seed
+        self.cache = LRUCache(cache_size)
+        self.model = None
+        self.lock = threading.Lock()
+
+    def load_model(self):
+        if self.model is None and self.model_name:
+            with self.lock:
+                if self.model is None:
+                    try:
+                        if self.model_name == "langdetect":
+                            from langdetect import DetectorFactory, detect
+                            # langdetect samples n-grams randomly unless seeded
+                            DetectorFactory.seed = self.seed
+                            self.model = detect
+                        else:
+                            import fasttext
+                            model = fasttext.load_model(self.model_name)
+                            self.model = lambda text: model.predict(text.replace("\n", " "))[0][0].replace("__label__", "")
+                    except Exception as e:
+                        print(f"⚠️ Language model {self.model_name} unavailable, using script rules only: {e}")
+                        self.model = False
+        return self.model or None
+
+    def model_language(self, text):
+        model = self.load_model()
+        if model is None:
+            return None
+        try:
+            return model(text)
+        except Exception:
+            return None
+
+    def classify(self, text):
+        histogram = script_histogram(text)
+        letters = sum(histogram.values())
+        if not letters:
+            return "en"
+        if histogram["devanagari"] / letters >= self.min_script_share:
+            language = devanagari_language(tokenize(text))
+            if language is None:
+                language = "mr" if self.model_language(text) == "mr" else "hi"
+            # Hindi typed with English words mixed in
+            if language == "hi" and histogram["latin"] / letters >= self.min_script_share:
+                return "hi-en"
+            return language
+        if histogram["other"] > histogram["latin"]:
+            return self.model_language(text) or "en"
+        return latin_language(tokenize(text)) or "en"
+
+    def detect(self, text):
+        key = normalize_query(text)
+        language = self.cache.get(key)
+        if language is None:
+            language = self.classify(text)
+            self.cache.set(key, language)
+        return language
+
+
+def translation_source(language):
+    return TRANSLATION_SOURCES.get(language, language)
+
+def reply_language(language):
+    return REPLY_LANGUAGES.get(language, "en")
@@ -0,0 +1,111 @@
+import os
+import re
+import json
+from collections import Counter
+import numpy as np
+from chunk_store import save_array
+
+BM25_TERMS_FILE = "bm25_terms.json"
+BM25_OFFSETS_FILE = "bm25_offsets.npy"
+BM25_ROWS_FILE = "bm25_rows.npy"
+BM25_FREQUENCIES_FILE = "bm25_tfs.npy"
+BM25_IDS_FILE = "bm25_ids.npy"
+BM25_LENGTHS_FILE = "bm25_lengths.npy"
+
+# Devanagari words keep their vowel signs; danda (।, ॥) is punctuation
+TOKEN_PATTERN = re.compile(r"[\u0900-\u0963\u0966-\u097F]+|[^\W_]+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.casefold())
+
+def lexical_index_exists(directory="."):
+    return all(os.path.exists(os.path.join(directory, name))
+               for name in (BM25_TERMS_FILE, BM25_OFFSETS_FILE, BM25_ROWS_FILE,
+                            BM25_FREQUENCIES_FILE, BM25_IDS_FILE, BM25_LENGTHS_FILE))
+
+def write_lexical_index(chunk_store, directory="."):
+    ids = np.array(sorted(chunk_store), dtype=np.int64)
+    lengths = np.zeros(len(ids), dtype=np.int32)
+    postings = {}
+    for row, chunk_id in enumerate(ids):
+        counts = Counter(tokenize(chunk_store[int(chunk_id)]))
+        lengths[row] = sum(counts.values())
+        for term, count in counts.items():
+            postings.setdefault(term, []).append((row, count))
+
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    for i, term in enumerate(terms):
+        offsets[i + 1] = offsets[i] + len(postings[term])
+    rows = np.zeros(offsets[-1], dtype=np.int32)
+    frequencies = np.zeros(offsets[-1], dtype=np.int32)
+    for i, term in enumerate(terms):
+        term_rows, term_frequencies = zip(*postings[term])
+        rows[offsets[i]:offsets[i + 1]] = term_rows
+        frequencies[offsets[i]:offsets[i + 1]] = term_frequencies
+
+    save_array(os.path.join(directory, BM25_OFFSETS_FILE), offsets)
+    save_array(os.path.join(directory, BM25_ROWS_FILE), rows)
+    save_array(os.path.join(directory, BM25_FREQUENCIES_FILE), frequencies)
+    save_array(os.path.join(directory, BM25_LENGTHS_FILE), lengths)
+    save_array(os.path.join(directory, BM25_IDS_FILE), ids)
+    terms_path = os.path.join(directory, BM25_TERMS_FILE)
+    with open(terms_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(terms, f, ensure_ascii=False)
+    os.replace(terms_path + ".tmp", terms_path)
+
+
+class BM25Index:
+    def __init__(self, directory=".", k1=1.2, b=0.75):
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        with open(os.path.join(directory, BM25_TERMS_FILE), "r", encoding="utf-8") as f:
+            self.terms = {term: i for i, term in enumerate(json.load(f))}
+        self.offsets = np.load(os.path.join(directory, BM25_OFFSETS_FILE), mmap_mode="r")
+        self.rows = np.load(os.path.join(directory, BM25_ROWS_FILE), mmap_mode="r")
+        self.frequencies = np.load(os.path.join(directory, BM25_FREQUENCIES_FILE), mmap_mode="r")
+        self.ids = np.load(os.path.join(directory, BM25_IDS_FILE), mmap_mode="r")
+        self.lengths = np.load(os.path.join(directory, BM25_LENGTHS_FILE))
+        self.average_length = float(self.lengths.mean()) if len(self.lengths) else 0.0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query, k=10, allowed=None):
+        matched_rows, matched_scores = [], []
+        for term in set(tokenize(query)):
+            i = self.terms.get(term)
+            if i is None:
+                continue
+            start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+            rows = np.asarray(self.rows[start:end])
+            frequencies = np.asarray(self.frequencies[start:end], dtype=np.float32)
+            idf = np.log(1.0 + (len(self.ids) - (end - start) + 0.5) / (end - start + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self.lengths[rows] / self.average_length)
+            matched_rows.append(rows)
+            matched_scores.append(idf * frequencies * (self.k1 + 1.0) / (frequencies + norm))
+        if not matched_rows:
+            return []
+
+        rows, inverse = np.unique(np.concatenate(matched_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(matched_scores))
+        if allowed is not None:
+            # Boolean mask over rows, for searches restricted to part of the corpus
+            keep = allowed[rows]
+            rows, scores = rows[keep], scores[keep]
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.lexsort((rows[top], -scores[top]))]
+        return [(int(self.ids[rows[i]]), float(scores[i])) for i in top]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
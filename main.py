@@ -1,16 +1,29 @@
+import time
+
+IMPORT_STARTED = time.perf_counter()
 
 import os
+import re
+import json
+import hashlib
+import threading
+import contextvars
 import openai
-import faiss
-import pickle
 import numpy as np
-import azure.cognitiveservices.speech as speechsdk
-from langdetect import detect
 from dotenv import load_dotenv
-from azure.core.credentials import AzureKeyCredential
-from azure.ai.translation.text import TextTranslationClient
 import datetime
-import speech_recognition as sr
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from chunk_store import ChunkStore, current_index_dir, read_index_version
+from lexical import BM25Index, lexical_index_exists, reciprocal_rank_fusion
+from embeddings import create_embedding_provider, normalize_embeddings
+from reranking import CrossEncoderReranker
+from caching import LRUCache, PersistentLRUCache, QueryCache
+from sessions import create_conversation_store, history_window
+from tts import SpeechService
+from language import LanguageDetector, reply_language, translation_source
+from asr import StreamingRecognizer, create_asr_backend
+from tracing import annotate, configure as configure_tracing, count, isolated_context, span, start_metrics_server, trace
 
 load_dotenv()
 
@@ -23,28 +36,314 @@ AZURE_SPEECH_KEY = os.getenv("AZURE_SPEECH_KEY")
 AZURE_SPEECH_REGION = os.getenv("AZURE_SPEECH_REGION")
 AZURE_TRANSLATOR_KEY = os.getenv("AZURE_TRANSLATOR_KEY")
 AZURE_TRANSLATOR_REGION = os.getenv("AZURE_TRANSLATOR_REGION")
-
-translator_client = TextTranslationClient(
-    credential=AzureKeyCredential(AZURE_TRANSLATOR_KEY),
-    endpoint=f"https://{AZURE_TRANSLATOR_REGION}.cognitiveservices.azure.com/"
-)
-
-os.makedirs("input", exist_ok=True)
-os.makedirs("output", exist_ok=True)
-
-chat_history = []
-
-def load_faiss_index():
+AZURE_TRANSLATOR_ENDPOINT = os.getenv("AZURE_TRANSLATOR_ENDPOINT") or f"https://{AZURE_TRANSLATOR_REGION}.cognitiveservices.azure.com/"
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+FAISS_MMAP = os.getenv("FAISS_MMAP", "true").lower() in ("1", "true", "yes")
+KB_RELOAD_CHECK_SECONDS = float(os.getenv("KB_RELOAD_CHECK_SECONDS", "30"))
+INDEX_DIR = os.getenv("INDEX_DIR", "indexes")
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+# Cosine similarity floor for indexes without a calibrated one, the same cut as a squared L2 distance of 1.5
+VECTOR_MIN_SIMILARITY = float(os.getenv("VECTOR_MIN_SIMILARITY", "0.25"))
+SEARCH_FILTERS = ("source", "section", "language")
+SEARCH_SCOPE_CACHE_SIZE = int(os.getenv("SEARCH_SCOPE_CACHE_SIZE", "64"))
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+RERANK_MIN_SCORE = float(os.getenv("RERANK_MIN_SCORE")) if os.getenv("RERANK_MIN_SCORE") else None
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_MAX_CHUNKS = int(os.getenv("CONTEXT_MAX_CHUNKS", "8"))
+BM25_MIN_SCORE = float(os.getenv("BM25_MIN_SCORE", "1.0"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+EMBEDDING_TIMEOUT_SECONDS = float(os.getenv("EMBEDDING_TIMEOUT_SECONDS", "5"))
+EMBEDDING_COOLDOWN_SECONDS = float(os.getenv("EMBEDDING_COOLDOWN_SECONDS", "30"))
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "azure")
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+LOCAL_EMBEDDING_BACKEND = os.getenv("LOCAL_EMBEDDING_BACKEND", "torch")
+LOCAL_EMBEDDING_QUANTIZE = os.getenv("LOCAL_EMBEDDING_QUANTIZE", "false").lower() in ("1", "true", "yes")
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "86400"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "2048"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SPEECH_OUTPUT_FORMAT = os.getenv("SPEECH_OUTPUT_FORMAT", "wav")
+SPEECH_POOL_SIZE = int(os.getenv("SPEECH_POOL_SIZE", "4"))
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", os.path.join("output", "audio"))
+AUDIO_CACHE_MAX_MB = float(os.getenv("AUDIO_CACHE_MAX_MB", "500"))
+VOICES = {"en": "en-IN-NeerjaNeural", "hi": "hi-IN-SwaraNeural", "mr": "mr-IN-AarohiNeural"}
+LANGUAGE_MODEL = os.getenv("LANGUAGE_MODEL", "langdetect")
+LANGUAGE_CACHE_SIZE = int(os.getenv("LANGUAGE_CACHE_SIZE", "4096"))
+ASR_BACKEND = os.getenv("ASR_BACKEND", "google")
+ASR_LANGUAGES = [code.strip() for code in os.getenv("ASR_LANGUAGES", "en-IN,hi-IN,mr-IN").split(",") if code.strip()]
+ASR_WORKERS = int(os.getenv("ASR_WORKERS", "4"))
+ASR_MAX_SEGMENT_SECONDS = float(os.getenv("ASR_MAX_SEGMENT_SECONDS", "15"))
+ASR_SILENCE_MS = int(os.getenv("ASR_SILENCE_MS", "500"))
+ASR_WHISPER_MODEL = os.getenv("ASR_WHISPER_MODEL", "openai/whisper-small")
+TRANSLATION_CACHE_PATH = os.getenv("TRANSLATION_CACHE_PATH", "translations.db")
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "100000"))
+TRANSLATION_BATCH_SIZE = 1000
+TRANSLATION_BATCH_CHARS = 50000
+CONVERSATION_STORE = os.getenv("CONVERSATION_STORE", "memory")
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", "conversations.db")
+CONVERSATION_MAX_SESSIONS = int(os.getenv("CONVERSATION_MAX_SESSIONS", "1000"))
+CONVERSATION_IDLE_SECONDS = float(os.getenv("CONVERSATION_IDLE_SECONDS", "3600"))
+CONVERSATION_MAX_TURNS = int(os.getenv("CONVERSATION_MAX_TURNS", "50"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1000"))
+SUMMARIZE_HISTORY = os.getenv("SUMMARIZE_HISTORY", "false").lower() in ("1", "true", "yes")
+SUMMARIZE_AFTER_TURNS = int(os.getenv("SUMMARIZE_AFTER_TURNS", "8"))
+KEEP_RECENT_TURNS = int(os.getenv("KEEP_RECENT_TURNS", "4"))
+DEFAULT_SESSION_ID = "default"
+SENTENCE_WORKERS = int(os.getenv("SENTENCE_WORKERS", "3"))
+MIN_SENTENCE_CHARS = int(os.getenv("MIN_SENTENCE_CHARS", "20"))
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", os.path.join("logs", "traces.jsonl"))
+TRACE_LOG_MAX_MB = float(os.getenv("TRACE_LOG_MAX_MB", "50"))
+TRACE_HISTORY = int(os.getenv("TRACE_HISTORY", "50"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+SENTENCE_END = re.compile(r"(?<=[.!?।])\s+(?=[^a-z0-9\s])|\n+")
+
+query_cache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL_SECONDS, SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD)
+language_detector = LanguageDetector(LANGUAGE_MODEL, LANGUAGE_CACHE_SIZE)
+
+_translator_client = None
+_client_lock = threading.Lock()
+_tracing_ready = False
+
+def setup_tracing():
+    global _tracing_ready
+    if not _tracing_ready:
+        with _client_lock:
+            if not _tracing_ready:
+                configure_tracing(TRACE_LOG_PATH, int(TRACE_LOG_MAX_MB * 2 ** 20), TRACE_HISTORY)
+                if METRICS_PORT:
+                    start_metrics_server(METRICS_PORT)
+                _tracing_ready = True
+
+def get_translator_client():
+    global _translator_client
+    if _translator_client is None:
+        with _client_lock:
+            if _translator_client is None:
+                from azure.core.credentials import AzureKeyCredential
+                from azure.ai.translation.text import TextTranslationClient
+                _translator_client = TextTranslationClient(
+                    credential=AzureKeyCredential(AZURE_TRANSLATOR_KEY),
+                    endpoint=AZURE_TRANSLATOR_ENDPOINT
+                )
+    return _translator_client
+
+_embedding_provider = None
+
+def get_embedding_provider():
+    global _embedding_provider
+    if _embedding_provider is None:
+        with _client_lock:
+            if _embedding_provider is None:
+                _embedding_provider = create_embedding_provider(
+                    EMBEDDING_PROVIDER, AZURE_DEPLOYMENT_EMBEDDINGS, LOCAL_EMBEDDING_MODEL,
+                    LOCAL_EMBEDDING_BACKEND, LOCAL_EMBEDDING_QUANTIZE, LOCAL_EMBEDDING_BATCH_SIZE
+                )
+    return _embedding_provider
+
+_reranker = None
+
+def get_reranker():
+    global _reranker
+    if _reranker is None and RERANK_MODEL:
+        with _client_lock:
+            if _reranker is None:
+                _reranker = CrossEncoderReranker(RERANK_MODEL, RERANK_BATCH_SIZE)
+    return _reranker or None
+
+def disable_reranker(error):
+    global _reranker
+    _reranker = False
+    print(f"⚠️ Re-ranker unavailable, using fused retrieval order: {error}")
+
+def read_index_metadata(directory="."):
+    try:
+        with open(os.path.join(directory, "manifest.json"), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    # Indexes built before providers were recorded all used the Azure deployment
+    return {
+        "embedding_provider": manifest.get("embedding_provider") or f"azure:{AZURE_DEPLOYMENT_EMBEDDINGS}",
+        "calibration": manifest.get("calibration") or {},
+    }
+
+def configure_faiss_search(index):
+    import faiss
+    params = faiss.ParameterSpace()
+    for name, value in (("nprobe", FAISS_NPROBE), ("efSearch", FAISS_EF_SEARCH)):
+        try:
+            params.set_index_parameter(index, name, value)
+        except RuntimeError:
+            pass
+
+def uses_inner_product(index):
+    import faiss
+    return index.metric_type == faiss.METRIC_INNER_PRODUCT
+
+def load_faiss_index(directory="."):
     try:
-        with open("chunks.pkl", "rb") as f:
-            chunks = pickle.load(f)
-        index = faiss.read_index("faiss_index.bin")
+        import faiss
+        chunks = ChunkStore(directory)
+        path = os.path.join(directory, "faiss_index.bin")
+        index = None
+        if FAISS_MMAP:
+            # Memory-mapped indexes share one copy in the page cache across server processes
+            try:
+                index = faiss.read_index(path, faiss.IO_FLAG_MMAP)
+            except RuntimeError:
+                pass
+        if index is None:
+            index = faiss.read_index(path)
+        configure_faiss_search(index)
         return index, chunks
     except Exception as e:
         print(f"⚠️ Error loading FAISS index: {e}")
         return None, None
 
-faiss_index, chunks = load_faiss_index()
+def load_lexical_index(directory="."):
+    if not lexical_index_exists(directory):
+        print("⚠️ BM25 index not found, using vector search only.")
+        return None
+    try:
+        return BM25Index(directory)
+    except Exception as e:
+        print(f"⚠️ Error loading BM25 index: {e}")
+        return None
+
+class KnowledgeBase:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = None
+        self.checked_at = 0.0
+        self.load_seconds = None
+
+    def get(self):
+        if self.state is None or time.monotonic() - self.checked_at > KB_RELOAD_CHECK_SECONDS:
+            self.refresh()
+        return self.state
+
+    def refresh(self):
+        with self.lock:
+            if self.state is not None and time.monotonic() - self.checked_at <= KB_RELOAD_CHECK_SECONDS:
+                return
+            self.checked_at = time.monotonic()
+            # Published builds are never modified, so everything is read from the directory the pointer names
+            directory = current_index_dir(INDEX_DIR)
+            version = read_index_version(directory)
+            if self.state is not None and self.state["version"] == version:
+                return
+            started = time.perf_counter()
+            index, chunks = load_faiss_index(directory)
+            if index is None or not chunks:
+                return
+            lexical = load_lexical_index(directory)
+            metadata = read_index_metadata(directory)
+            built_with = metadata["embedding_provider"]
+            provider = get_embedding_provider()
+            if built_with != provider.name:
+                print(f"⚠️ Knowledge base was built with {built_with} but queries use {provider.name}, vector search is disabled.")
+            else:
+                try:
+                    provider.warm_up()
+                except Exception as e:
+                    print(f"⚠️ Error loading embedding model: {e}")
+            reranker = get_reranker()
+            if reranker is not None:
+                try:
+                    reranker.warm_up()
+                except Exception as e:
+                    disable_reranker(e)
+            self.load_seconds = time.perf_counter() - started
+            if not uses_inner_product(index):
+                print("⚠️ FAISS index was built for L2 search, run vectors.py to rebuild it for normalized inner-product search.")
+            self.state = {"version": version, "index": index, "chunks": chunks, "lexical": lexical,
+                          "embedding_provider": built_with, "calibration": metadata["calibration"],
+                          "inner_product": uses_inner_product(index), "scopes": LRUCache(SEARCH_SCOPE_CACHE_SIZE)}
+            print(f"✓ Knowledge base {version or 'unversioned'} loaded in {self.load_seconds:.2f}s")
+
+    def timings(self):
+        return {"import_seconds": IMPORT_SECONDS, "load_seconds": self.load_seconds}
+
+_knowledge_base = KnowledgeBase()
+
+def get_knowledge_base():
+    return _knowledge_base
+
+_conversation_store = None
+_conversation_lock = threading.Lock()
+_summary_executor = ThreadPoolExecutor(max_workers=1)
+_summarizing = set()
+_encoding = None
+
+def get_conversation_store():
+    global _conversation_store
+    if _conversation_store is None:
+        with _conversation_lock:
+            if _conversation_store is None:
+                _conversation_store = create_conversation_store(
+                    CONVERSATION_STORE, CONVERSATION_DB_PATH, CONVERSATION_MAX_SESSIONS,
+                    CONVERSATION_IDLE_SECONDS, CONVERSATION_MAX_TURNS
+                )
+    return _conversation_store
+
+def count_tokens(text):
+    global _encoding
+    if _encoding is None:
+        import tiktoken
+        _encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+    return len(_encoding.encode_ordinary(text))
+
+def conversation_history(session_id):
+    conversation = get_conversation_store().get(session_id or DEFAULT_SESSION_ID)
+    return history_window(conversation, HISTORY_TOKEN_BUDGET, count_tokens)
+
+def summarize_history(session_id):
+    store = get_conversation_store()
+    conversation = store.get(session_id)
+    older = conversation["turns"][:-KEEP_RECENT_TURNS or None]
+    if not older:
+        return
+    transcript = "\n".join(f"User: {user_msg}\nAssistant: {bot_msg}" for user_msg, bot_msg in older)
+    previous = f"Summary so far:\n{conversation['summary']}\n\n" if conversation["summary"] else ""
+    setup_openai()
+    try:
+        completion = openai.ChatCompletion.create(
+            engine=AZURE_OPENAI_DEPLOYMENT,
+            temperature=0,
+            messages=[
+                {"role": "system", "content": "Summarize the conversation in at most five short sentences, keeping names, numbers and open questions."},
+                {"role": "user", "content": f"{previous}Conversation:\n{transcript}"},
+            ]
+        )
+        # Turns recorded while the summary was being written are not in it, so they are kept as well
+        added = max(0, len(store.get(session_id)["turns"]) - len(conversation["turns"]))
+        store.compact(session_id, completion["choices"][0]["message"]["content"], KEEP_RECENT_TURNS + added)
+    except Exception as e:
+        print(f"⚠️ History summarization failed: {e}")
+
+def record_turn(session_id, user_msg, bot_msg):
+    if bot_msg.startswith("⚠️"):
+        return
+    session_id = session_id or DEFAULT_SESSION_ID
+    store = get_conversation_store()
+    store.append(session_id, user_msg, bot_msg)
+    if SUMMARIZE_HISTORY and len(store.get(session_id)["turns"]) > SUMMARIZE_AFTER_TURNS:
+        # One pending job per session; turns added meanwhile are picked up by the next one
+        with _conversation_lock:
+            if session_id in _summarizing:
+                return
+            _summarizing.add(session_id)
+        _summary_executor.submit(run_summary, session_id)
+
+def run_summary(session_id):
+    try:
+        summarize_history(session_id)
+    finally:
+        with _conversation_lock:
+            _summarizing.discard(session_id)
 
 def setup_openai():
     openai.api_type = "azure"
@@ -52,114 +351,520 @@ def setup_openai():
     openai.api_version = AZURE_OPENAI_API_VERSION
     openai.api_key = AZURE_OPENAI_API_KEY
 
-def translate_text(text, from_lang, to_lang):
-    try:
-        response = translator_client.translate(
-            body={"contents": [text], "from": from_lang, "to": [to_lang]}
-        )
-        return response[0].translations[0].text
-    except Exception as e:
-        print(f"⚠️ Translation failed: {e}")
-        return text
-
-def get_response_from_faiss(query, detected_lang="en"):
-    if not faiss_index or not chunks:
-        return "⚠️ Knowledge base is not loaded."
-
-    setup_openai()
+def translation_key(text, from_lang, to_lang):
+    return f"{from_lang or 'auto'}\x1f{to_lang}\x1f{text}"
+
+_translation_cache = None
+
+def get_translation_cache():
+    global _translation_cache
+    if _translation_cache is None:
+        with _client_lock:
+            if _translation_cache is None:
+                _translation_cache = PersistentLRUCache(TRANSLATION_CACHE_PATH, TRANSLATION_CACHE_SIZE)
+    return _translation_cache
+
+def cached_translation(text, from_lang, to_lang):
+    # Seeds are checked first so cache eviction can never send them back to the translator
+    seeded = SEEDED_TRANSLATIONS.get((text, from_lang, to_lang))
+    if seeded is not None:
+        return seeded
+    return get_translation_cache().get(translation_key(text, from_lang, to_lang))
+
+def translation_batches(texts):
+    batch, batch_chars = [], 0
+    for text in texts:
+        if batch and (len(batch) >= TRANSLATION_BATCH_SIZE or batch_chars + len(text) > TRANSLATION_BATCH_CHARS):
+            yield batch
+            batch, batch_chars = [], 0
+        batch.append(text)
+        batch_chars += len(text)
+    if batch:
+        yield batch
+
+def translate_texts(texts, from_lang, to_lang):
+    cache = get_translation_cache()
+    translations = {}
+    missing = []
+    for text in dict.fromkeys(texts):
+        cached = cached_translation(text, from_lang, to_lang) if text.strip() else text
+        if cached is None:
+            missing.append(text)
+        else:
+            translations[text] = cached
+    count("cache_hits", len(translations), cache="translation")
+    count("cache_misses", len(missing), cache="translation")
+    for batch in translation_batches(missing):
+        try:
+            body = {"contents": batch, "to": [to_lang]}
+            if from_lang:
+                body["from"] = from_lang
+            response = get_translator_client().translate(body=body)
+            for text, item in zip(batch, response):
+                translations[text] = item.translations[0].text
+                cache.set(translation_key(text, from_lang, to_lang), translations[text])
+        except Exception as e:
+            print(f"⚠️ Translation failed: {e}")
+    return [translations.get(text, text) for text in texts]
 
+def translate_text(text, from_lang, to_lang):
+    return translate_texts([text], from_lang, to_lang)[0]
+
+def translate_answer(text, from_lang, to_lang):
+    # Whole answers are cached too (the seeded messages), so look them up before splitting
+    cached = cached_translation(text, from_lang, to_lang)
+    if cached is not None:
+        count("cache_hits", cache="translation")
+        return cached
+    parts = re.split(f"({SENTENCE_END.pattern})", text)
+    sentences = parts[::2]
+    translated = translate_texts(sentences, from_lang, to_lang)
+    parts[::2] = translated
+    return "".join(part or "" for part in parts)
+
+NOT_FOUND_MESSAGES = {
+    "en": "I'm sorry, I couldn't find relevant information. Could you please rephrase your question?",
+    "hi": "माफ़ कीजिए, मुझे प्रासंगिक जानकारी नहीं मिली। कृपया अपना प्रश्न दोबारा पूछें।",
+    "mr": "माफ करा, मला संबंधित माहिती सापडली नाही. कृपया आपला प्रश्न पुन्हा विचारा.",
+}
+
+def seeded_translations():
+    seeds = {}
+    for lang in ("hi", "mr"):
+        english, localized = NOT_FOUND_MESSAGES["en"], NOT_FOUND_MESSAGES[lang]
+        # Streaming translates sentence by sentence, so the sentences are seeded as well as the whole message
+        for source, target in [(english, localized)] + list(zip(SENTENCE_END.split(english), SENTENCE_END.split(localized))):
+            seeds[(source, "en", lang)] = target
+            seeds[(target, "en", lang)] = target
+    return seeds
+
+SEEDED_TRANSLATIONS = seeded_translations()
+
+def not_found_message(detected_lang):
+    return NOT_FOUND_MESSAGES[reply_language(detected_lang)]
+
+def filter_key(filters):
+    return tuple(sorted((name, str(value)) for name, value in (filters or {}).items() if value and name in SEARCH_FILTERS))
+
+def search_scope(state, filters):
+    key = filter_key(filters)
+    if not key:
+        return None
+    scope = state["scopes"].get(key)
+    if scope is None:
+        metadata = state["chunks"].metadata
+        if metadata is None:
+            print("⚠️ Knowledge base has no chunk metadata, ignoring search filters. Run vectors.py to enable them.")
+            return None
+        import faiss
+        ids = metadata.select(**dict(key))
+        lexical = state.get("lexical")
+        scope = {
+            "key": key,
+            "ids": ids,
+            "selector": faiss.IDSelectorBatch(ids),
+            "lexical_mask": np.isin(lexical.ids, ids) if lexical is not None else None,
+        }
+        state["scopes"].set(key, scope)
+    return scope
+
+def document_sources(state):
+    metadata = state["chunks"].metadata if state else None
+    if metadata is None:
+        return []
+    return sorted({os.path.basename(source) for source in metadata.values("source")})
+
+def search_parameters(index, selector):
+    import faiss
+    # Parameters given with a selector replace the index's own, so nprobe and efSearch are carried over
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=inner.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+def lexical_search(state, query, scope=None):
+    if state.get("lexical") is None:
+        return []
+    hits = state["lexical"].search(query, RETRIEVAL_CANDIDATES, None if scope is None else scope["lexical_mask"])
+    return [chunk_id for chunk_id, score in hits if score >= BM25_MIN_SCORE]
+
+def vector_search_batch(state, query_embeddings, scope=None):
+    if scope is not None and not len(scope["ids"]):
+        return [[] for _ in range(len(query_embeddings))]
+    index = state["index"]
+    # A filtered query only scans the vectors its selector lets through
+    params = search_parameters(index, scope["selector"]) if scope is not None else None
+    if state["inner_product"]:
+        scores, indices = index.search(normalize_embeddings(query_embeddings), k=RETRIEVAL_CANDIDATES, params=params)
+        min_score = state["calibration"].get("vector_min_similarity", VECTOR_MIN_SIMILARITY)
+    else:
+        distances, indices = index.search(query_embeddings, k=RETRIEVAL_CANDIDATES, params=params)
+        scores, min_score = -distances, -state["calibration"].get("vector_max_distance", float("inf"))
+    return [[int(i) for score, i in zip(row_scores, row_indices) if i >= 0 and score >= min_score]
+            for row_scores, row_indices in zip(scores, indices)]
+
+def vector_search(state, query_embedding, scope=None):
+    return vector_search_batch(state, query_embedding, scope)[0]
+
+def rerank_passages(state, query, passages):
+    reranker = get_reranker()
+    if reranker is None or not passages:
+        return passages
     try:
-        embedding_response = openai.Embedding.create(
-            deployment_id=AZURE_DEPLOYMENT_EMBEDDINGS,
-            input=[query]
-        )
-        query_embedding = np.array(embedding_response["data"][0]["embedding"], dtype=np.float32).reshape(1, -1)
+        ranked = reranker.rerank(query, passages)
     except Exception as e:
-        return f"⚠️ Error generating embeddings: {e}"
-
-    distances, indices = faiss_index.search(query_embedding, k=3)
-    retrieved_chunks = [chunks[i] for i in indices[0] if i != -1]
-
-    if all(dist > 1.5 for dist in distances[0]) or not retrieved_chunks:
-        polite_message = {
-            "en": "I'm sorry, I couldn't find relevant information. Could you please rephrase your question?",
-            "hi": "माफ़ कीजिए, मुझे प्रासंगिक जानकारी नहीं मिली। कृपया अपना प्रश्न दोबारा पूछें।"
-        }
-        return polite_message["hi"] if detected_lang in ["hi", "hi-en"] else polite_message["en"]
-
+        disable_reranker(e)
+        return passages
+    calibration = state["calibration"]
+    # Calibrated cutoffs only apply to scores from the model they were calibrated with
+    threshold = calibration.get("rerank_min_score") if calibration.get("reranker") == reranker.model_name else RERANK_MIN_SCORE
+    return [passages[i] for i, score in ranked if threshold is None or score >= threshold]
+
+def pack_context(passages, token_budget=CONTEXT_TOKEN_BUDGET, max_chunks=CONTEXT_MAX_CHUNKS):
+    packed, used = [], 0
+    for passage in passages:
+        tokens = count_tokens(passage)
+        if packed and used + tokens > token_budget:
+            continue
+        packed.append(passage)
+        used += tokens
+        if len(packed) >= max_chunks:
+            break
+    count("tokens", used, kind="context")
+    return packed
+
+def search_chunks(state, query, query_embedding=None, lexical_ids=None, vector_ids=None, scope=None):
+    rankings = [lexical_search(state, query, scope) if lexical_ids is None else lexical_ids]
+    if vector_ids is not None:
+        rankings.append(vector_ids)
+    elif query_embedding is not None:
+        with span("vector", filtered=scope is not None):
+            rankings.append(vector_search(state, query_embedding, scope))
+    chunks = state["chunks"]
+    candidates = [i for i in reciprocal_rank_fusion(rankings, RRF_K)[:RETRIEVAL_CANDIDATES] if i in chunks]
+    with span("rerank", candidates=len(candidates)):
+        passages = rerank_passages(state, query, [chunks[i] for i in candidates])
+    return pack_context(passages)
+
+def embedding_mismatch_message(state, provider):
+    return f"⚠️ Knowledge base was built with {state['embedding_provider']} embeddings but queries use {provider.name}."
+
+_embedding_retry_at = 0.0
+
+def embedding_available():
+    return time.monotonic() >= _embedding_retry_at
+
+def embedding_failed(error):
+    global _embedding_retry_at
+    _embedding_retry_at = time.monotonic() + EMBEDDING_COOLDOWN_SECONDS
+    print(f"⚠️ Embedding service unavailable, using lexical search for {EMBEDDING_COOLDOWN_SECONDS:.0f}s: {error}")
+
+def build_messages(retrieved_chunks, query, history=None):
     context = "\n---\n".join(retrieved_chunks)
 
     messages = [
         {"role": "system", "content": "You are an intelligent assistant. Answer based on the context provided."},
     ]
 
-    for user_msg, bot_msg in chat_history[-5:]:
+    history = history or {"summary": None, "turns": []}
+    if history["summary"]:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation: {history['summary']}"})
+    for user_msg, bot_msg in history["turns"]:
         messages.append({"role": "user", "content": user_msg})
         messages.append({"role": "assistant", "content": bot_msg})
 
     messages.append({"role": "user", "content": f"Context:\n{context}\n\nQuestion: {query}"})
+    return messages
+
+def history_key(history):
+    if not history["summary"] and not history["turns"]:
+        return ()
+    digest = hashlib.sha256(json.dumps([history["summary"], history["turns"]], ensure_ascii=False).encode("utf-8")).hexdigest()
+    return (("history", digest),)
+
+def prepare_completion(query, detected_lang="en", knowledge_base=None, session_id=None, filters=None):
+    state = (knowledge_base or get_knowledge_base()).get()
+    if state is None:
+        return "⚠️ Knowledge base is not loaded.", None
+    scope = search_scope(state, filters)
+    if scope is not None:
+        annotate(scope_chunks=len(scope["ids"]))
+        if not len(scope["ids"]):
+            return not_found_message(detected_lang), None
+    history = conversation_history(session_id)
+    # Follow-ups depend on the conversation, so their answers are only reused within the same history
+    scope_key = (scope["key"] if scope is not None else ()) + history_key(history)
+
+    cached = query_cache.get_exact(query, state["version"], scope_key)
+    count("cache_hits" if cached is not None else "cache_misses", cache="exact")
+    if cached is not None:
+        return cached, None
+
+    provider = get_embedding_provider()
+    with span("lexical"):
+        lexical_ids = lexical_search(state, query, scope)
+    query_embedding = None
+    if state["embedding_provider"] != provider.name:
+        if not lexical_ids:
+            return embedding_mismatch_message(state, provider), None
+    # With lexical matches in hand, skip the embedding call while the service is backing off
+    elif not lexical_ids or embedding_available():
+        setup_openai()
+        try:
+            with span("embed", provider=provider.name):
+                query_embedding = provider.embed([query], timeout=EMBEDDING_TIMEOUT_SECONDS)
+        except Exception as e:
+            embedding_failed(e)
+            if not lexical_ids:
+                return f"⚠️ Error generating embeddings: {e}", None
+
+    if query_embedding is not None:
+        cached = query_cache.get_semantic(query_embedding, state["version"], scope_key)
+        count("cache_hits" if cached is not None else "cache_misses", cache="semantic")
+        if cached is not None:
+            return cached, None
+    else:
+        count("lexical_fallbacks")
+
+    retrieved_chunks = search_chunks(state, query, query_embedding, lexical_ids, scope=scope)
+    if not retrieved_chunks:
+        return not_found_message(detected_lang), None
+
+    messages = build_messages(retrieved_chunks, query, history)
+    annotate(context_chunks=len(retrieved_chunks))
+    return None, (messages, query_embedding, state["version"], scope_key)
+
+def chat_completion(messages):
+    setup_openai()
+    completion = openai.ChatCompletion.create(
+        engine=AZURE_OPENAI_DEPLOYMENT,
+        temperature=0.3,
+        messages=messages
+    )
+    usage = completion.get("usage") or {}
+    count("tokens", usage.get("prompt_tokens", 0), kind="prompt")
+    count("tokens", usage.get("completion_tokens", 0), kind="completion")
+    return completion["choices"][0]["message"]["content"]
+
+def get_response_from_faiss(query, detected_lang="en", knowledge_base=None, session_id=None, filters=None):
+    answer, prompt = prepare_completion(query, detected_lang, knowledge_base, session_id, filters)
+    if prompt is None:
+        return answer
+    messages, query_embedding, version, scope_key = prompt
 
     try:
-        completion = openai.ChatCompletion.create(
-            engine=AZURE_OPENAI_DEPLOYMENT,
-            temperature=0.3,
-            messages=messages
-        )
-        return completion["choices"][0]["message"]["content"]
+        with span("chat"):
+            answer = chat_completion(messages)
     except Exception as e:
         return f"⚠️ Error generating response: {e}"
+    query_cache.set(query, query_embedding, answer, version, scope_key)
+    return answer
+
+def stream_response_from_faiss(query, detected_lang="en", knowledge_base=None, session_id=None, filters=None):
+    answer, prompt = prepare_completion(query, detected_lang, knowledge_base, session_id, filters)
+    if prompt is None:
+        yield answer
+        return
+    messages, query_embedding, version, scope_key = prompt
+
+    setup_openai()
+    parts = []
+    try:
+        chat_started = time.perf_counter()
+        with span("chat", stream=True) as chat_span:
+            for event in openai.ChatCompletion.create(
+                engine=AZURE_OPENAI_DEPLOYMENT,
+                temperature=0.3,
+                messages=messages,
+                stream=True
+            ):
+                choices = event.get("choices") or []
+                delta = choices[0].get("delta", {}).get("content") if choices else None
+                if delta:
+                    if not parts:
+                        chat_span["attributes"]["first_token_ms"] = round((time.perf_counter() - chat_started) * 1000, 3)
+                    parts.append(delta)
+                    yield delta
+    except Exception as e:
+        yield f"⚠️ Error generating response: {e}"
+        return
+    count("tokens", count_tokens("".join(parts)), kind="completion")
+    query_cache.set(query, query_embedding, "".join(parts), version, scope_key)
+
+class SentenceSplitter:
+    def __init__(self, min_chars=MIN_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self.buffer = ""
+
+    def feed(self, text):
+        self.buffer += text
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self.buffer):
+            sentence = self.buffer[start:match.start()].strip()
+            if len(sentence) >= self.min_chars:
+                sentences.append(sentence)
+                start = match.end()
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self):
+        rest, self.buffer = self.buffer.strip(), ""
+        return [rest] if rest else []
+
+_speech_service = None
+
+def get_speech_service():
+    global _speech_service
+    if _speech_service is None:
+        with _client_lock:
+            if _speech_service is None:
+                _speech_service = SpeechService(
+                    AZURE_SPEECH_KEY, AZURE_SPEECH_REGION, SPEECH_OUTPUT_FORMAT,
+                    AUDIO_CACHE_DIR, int(AUDIO_CACHE_MAX_MB * 2 ** 20), SPEECH_POOL_SIZE
+                )
+    return _speech_service
 
 def generate_speech(response_text, language="en"):
-    speech_config = speechsdk.SpeechConfig(subscription=AZURE_SPEECH_KEY, region=AZURE_SPEECH_REGION)
-    speech_config.speech_synthesis_voice_name = "hi-IN-SwaraNeural" if language != "en" else "en-IN-NeerjaNeural"
-    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-    file_name = f"output/response_{timestamp}.wav"
-    audio_config = speechsdk.audio.AudioOutputConfig(filename=file_name)
-    synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=audio_config)
+    voice = VOICES.get(language, VOICES["en"])
+    return get_speech_service().synthesize(response_text, voice)
 
-    result = synthesizer.speak_text_async(response_text).get()
-    if result.reason != speechsdk.ResultReason.SynthesizingAudioCompleted:
-        print(f"⚠️ Speech synthesis error: {result.reason}")
-    return file_name
+_speech_recognizer = None
 
-def recognize_audio_file(file_path):
-    recognizer = sr.Recognizer()
-    with sr.AudioFile(file_path) as source:
-        audio = recognizer.record(source)
+def get_speech_recognizer():
+    global _speech_recognizer
+    if _speech_recognizer is None:
+        with _client_lock:
+            if _speech_recognizer is None:
+                backend = create_asr_backend(ASR_BACKEND, ASR_LANGUAGES, AZURE_SPEECH_KEY, AZURE_SPEECH_REGION, ASR_WHISPER_MODEL)
+                _speech_recognizer = StreamingRecognizer(backend, ASR_WORKERS, ASR_MAX_SEGMENT_SECONDS, ASR_SILENCE_MS)
+    return _speech_recognizer
+
+def stream_audio_transcript(file_path):
     try:
-        return recognizer.recognize_google(audio)
+        yield from get_speech_recognizer().stream_file(file_path)
     except Exception as e:
         print(f"⚠️ Speech recognition error: {e}")
-        return ""
+
+def recognize_audio_file(file_path):
+    transcript = ""
+    for transcript in stream_audio_transcript(file_path):
+        pass
+    return transcript
 
 def save_text_to_file(text, folder="input"):
+    os.makedirs(folder, exist_ok=True)
     timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
     path = os.path.join(folder, f"{folder}_{timestamp}.txt")
     with open(path, "w", encoding="utf-8") as f:
         f.write(text)
     return path
 
-def process_input(input_text_or_file):
-    if os.path.isfile(input_text_or_file):
-        input_text = recognize_audio_file(input_text_or_file)
-    else:
-        input_text = input_text_or_file
-
-    save_text_to_file(input_text, "input")
-
-    detected_lang = detect(input_text)
-    is_hinglish = any(ord(c) > 127 for c in input_text) and any(ord(c) < 128 for c in input_text)
-    detected_lang = "hi-en" if is_hinglish else detected_lang
-
-    translated_query = translate_text(input_text, detected_lang, "en") if detected_lang != "en" else input_text
-    response_text = get_response_from_faiss(translated_query, detected_lang)
-
-    final_response = translate_text(response_text, "en", "hi") if detected_lang in ["hi", "hi-en"] else response_text
-
-    chat_history.append((input_text, final_response))
-    save_text_to_file(final_response, "output")
-
-    audio_file = generate_speech(final_response, "hi" if detected_lang in ["hi", "hi-en"] else "en")
-
-    return final_response, audio_file
-
+def detect_language(text):
+    return language_detector.detect(text)
+
+def process_input(input_text_or_file, knowledge_base=None, session_id=None, filters=None):
+    setup_tracing()
+    with trace("process_input"):
+        if os.path.isfile(input_text_or_file):
+            with span("recognize"):
+                input_text = recognize_audio_file(input_text_or_file)
+        else:
+            input_text = input_text_or_file
+
+        with span("save_input"):
+            save_text_to_file(input_text, "input")
+
+        with span("detect"):
+            detected_lang = detect_language(input_text)
+        annotate(language=detected_lang, input_chars=len(input_text))
+
+        reply_lang = reply_language(detected_lang)
+        with span("translate_query"):
+            translated_query = translate_text(input_text, translation_source(detected_lang), "en") if detected_lang != "en" else input_text
+        with span("answer"):
+            response_text = get_response_from_faiss(translated_query, detected_lang, knowledge_base, session_id, filters)
+
+        with span("translate_answer"):
+            final_response = translate_answer(response_text, "en", reply_lang) if reply_lang != "en" else response_text
+
+        record_turn(session_id, translated_query, response_text)
+        with span("save_output"):
+            save_text_to_file(final_response, "output")
+
+        with span("speech"):
+            audio_file = generate_speech(final_response, reply_lang)
+
+        return final_response, audio_file
+
+@isolated_context
+def process_input_streaming(input_text_or_file, knowledge_base=None, session_id=None, filters=None):
+    setup_tracing()
+    with trace("process_input_streaming"):
+        if os.path.isfile(input_text_or_file):
+            input_text = ""
+            recognize_started = time.perf_counter()
+            with span("recognize") as recognize_span:
+                for input_text in stream_audio_transcript(input_text_or_file):
+                    recognize_span["attributes"].setdefault("first_partial_ms", round((time.perf_counter() - recognize_started) * 1000, 3))
+                    yield ("transcript", input_text)
+        else:
+            input_text = input_text_or_file
+
+        with span("save_input"):
+            save_text_to_file(input_text, "input")
+
+        with span("detect"):
+            detected_lang = detect_language(input_text)
+        annotate(language=detected_lang, input_chars=len(input_text))
+        yield ("language", detected_lang)
+
+        reply_lang = reply_language(detected_lang)
+        with span("translate_query"):
+            translated_query = translate_text(input_text, translation_source(detected_lang), "en") if detected_lang != "en" else input_text
+
+        def render_sentence(sentence):
+            with span("render_sentence", chars=len(sentence)):
+                text = translate_text(sentence, "en", reply_lang) if reply_lang != "en" else sentence
+                try:
+                    return text, generate_speech(text, reply_lang)
+                except Exception as e:
+                    print(f"⚠️ Speech synthesis error: {e}")
+                    return text, None
+
+        tokens, sentences, audio_files = [], [], []
+        splitter = SentenceSplitter()
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=SENTENCE_WORKERS) as executor:
+            for delta in stream_response_from_faiss(translated_query, detected_lang, knowledge_base, session_id, filters):
+                tokens.append(delta)
+                yield ("token", delta)
+                for sentence in splitter.feed(delta):
+                    pending.append(executor.submit(contextvars.copy_context().run, render_sentence, sentence))
+                while pending and pending[0].done():
+                    text, audio_file = pending.popleft().result()
+                    sentences.append(text)
+                    audio_files.append(audio_file)
+                    yield ("sentence", text, audio_file)
+            for sentence in splitter.flush():
+                pending.append(executor.submit(contextvars.copy_context().run, render_sentence, sentence))
+            while pending:
+                text, audio_file = pending.popleft().result()
+                sentences.append(text)
+                audio_files.append(audio_file)
+                yield ("sentence", text, audio_file)
+
+        final_response = " ".join(sentences) if reply_lang != "en" else "".join(tokens)
+        record_turn(session_id, translated_query, "".join(tokens))
+        with span("save_output"):
+            save_text_to_file(final_response, "output")
+
+        audio_files = [path for path in audio_files if path and os.path.exists(path)]
+        with span("combine_audio"):
+            audio_file = get_speech_service().combine(audio_files) if audio_files else None
+        yield ("done", final_response, audio_file)
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
@@ -0,0 +1,39 @@
+import threading
+import numpy as np
+
+
+class CrossEncoderReranker:
+    def __init__(self, model_name, batch_size=32, max_length=512, device="cpu"):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.device = device
+        self.model = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.model is None:
+            with self.lock:
+                if self.model is None:
+                    from sentence_transformers import CrossEncoder
+                    model = CrossEncoder(self.model_name, max_length=self.max_length, device=self.device)
+                    model.predict([("warm-up", "warm-up")], batch_size=1, show_progress_bar=False)
+                    self.model = model
+        return self.model
+
+    def warm_up(self):
+        self.load()
+
+    def score_pairs(self, pairs):
+        if not pairs:
+            return np.zeros(0, dtype=np.float32)
+        return np.asarray(
+            self.load().predict(pairs, batch_size=self.batch_size, show_progress_bar=False), dtype=np.float32
+        ).reshape(-1)
+
+    def score(self, query, passages):
+        return self.score_pairs([(query, passage) for passage in passages])
+
+    def rerank(self, query, passages):
+        scores = self.score(query, passages)
+        return [(int(i), float(scores[i])) for i in np.argsort(-scores, kind="stable")]
@@ -0,0 +1,341 @@
+import os
+import sys
+import json
+import uuid
+import asyncio
+import argparse
+import multiprocessing
+from contextlib import aclosing, asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import WSMsgType, web
+from caching import normalize_query
+from tracing import count, recent_traces, render_metrics
+from tts import audio_mime_type
+from main import (AUDIO_CACHE_DIR, SEARCH_FILTERS, conversation_history, document_sources, filter_key, get_knowledge_base,
+                  process_input_streaming, record_turn, setup_tracing)
+from async_pipeline import close_http_sessions, process_input_async
+
+QA_SERVER_HOST = os.getenv("QA_SERVER_HOST", "0.0.0.0")
+QA_SERVER_PORT = int(os.getenv("QA_SERVER_PORT", "8080"))
+QA_SERVER_WORKERS = int(os.getenv("QA_SERVER_WORKERS", "1"))
+QA_MAX_ACTIVE = int(os.getenv("QA_MAX_ACTIVE", "16"))
+QA_MAX_QUEUE = int(os.getenv("QA_MAX_QUEUE", "64"))
+QA_QUEUE_TIMEOUT_SECONDS = float(os.getenv("QA_QUEUE_TIMEOUT_SECONDS", "10"))
+QA_MAX_UPLOAD_MB = float(os.getenv("QA_MAX_UPLOAD_MB", "25"))
+BUSY_MESSAGE = "⚠️ The service is busy, please try again in a moment."
+TIMEOUT_MESSAGE = "⚠️ The answering service timed out, please try again."
+AUDIO_UPLOAD_EXTENSIONS = (".wav", ".m4a", ".mp3", ".mp4", ".ogg", ".oga", ".opus", ".webm", ".flac", ".aac")
+
+
+class Overloaded(Exception):
+    pass
+
+
+class AdmissionController:
+    def __init__(self, max_active=QA_MAX_ACTIVE, max_queue=QA_MAX_QUEUE, queue_timeout=QA_QUEUE_TIMEOUT_SECONDS):
+        self.semaphore = asyncio.Semaphore(max_active)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+
+    @asynccontextmanager
+    async def admit(self):
+        if self.semaphore.locked() and self.waiting >= self.max_queue:
+            count("rejected_requests", reason="queue_full")
+            raise Overloaded("queue full")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            count("rejected_requests", reason="queue_timeout")
+            raise Overloaded("queue timeout")
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.semaphore.release()
+
+    def stats(self):
+        return {"active": self.active, "waiting": self.waiting, "max_queue": self.max_queue}
+
+
+class RequestCoalescer:
+    def __init__(self):
+        self.inflight = {}
+
+    async def run(self, key, factory):
+        if key is None:
+            return await factory(), False
+        task = self.inflight.get(key)
+        if task is not None:
+            count("coalesced_requests")
+            return await asyncio.shield(task), True
+        task = self.inflight[key] = asyncio.ensure_future(factory())
+        task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        return await asyncio.shield(task), False
+
+
+def audio_url(path):
+    if not path or os.path.dirname(os.path.abspath(path)) != os.path.abspath(AUDIO_CACHE_DIR):
+        return None
+    return f"/v1/audio/{os.path.basename(path)}"
+
+def busy_response():
+    return web.json_response({"error": BUSY_MESSAGE}, status=503, headers={"Retry-After": "1"})
+
+def timeout_response():
+    return web.json_response({"error": TIMEOUT_MESSAGE}, status=504)
+
+def backend_error_response(error):
+    return web.json_response({"error": f"⚠️ Error generating response: {error!r}"}, status=502)
+
+def read_filters(filters):
+    if isinstance(filters, str):
+        try:
+            filters = json.loads(filters) if filters else None
+        except ValueError:
+            raise web.HTTPBadRequest(text="'filters' must be a JSON object")
+    if not filters:
+        return None
+    if not isinstance(filters, dict) or set(filters) - set(SEARCH_FILTERS):
+        raise web.HTTPBadRequest(text=f"'filters' may only contain {', '.join(SEARCH_FILTERS)}")
+    return filters
+
+async def read_request(request):
+    if request.content_type.startswith("multipart/"):
+        form = await request.post()
+        upload = form.get("audio")
+        if upload is None or not hasattr(upload, "file"):
+            raise web.HTTPBadRequest(text="expected an 'audio' file field")
+        filters = read_filters(form.get("filters"))
+        os.makedirs("input", exist_ok=True)
+        # ffmpeg probes the content anyway, so an unknown extension is just dropped
+        extension = os.path.splitext(upload.filename or "")[1].lower()
+        path = os.path.join("input", f"upload_{uuid.uuid4().hex}{extension if extension in AUDIO_UPLOAD_EXTENSIONS else ''}")
+        with open(path, "wb") as f:
+            f.write(upload.file.read())
+        return {"input": path, "session_id": form.get("session_id") or None, "audio": True, "filters": filters}
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="expected a JSON body")
+    if not isinstance(payload, dict):
+        raise web.HTTPBadRequest(text="expected a JSON object")
+    query = str(payload.get("query") or "").strip()
+    if not query:
+        raise web.HTTPBadRequest(text="'query' is required")
+    return {"input": query, "session_id": payload.get("session_id") or None, "audio": False,
+            "filters": read_filters(payload.get("filters"))}
+
+def discard_upload(payload):
+    if payload["audio"]:
+        try:
+            os.remove(payload["input"])
+        except OSError:
+            pass
+
+async def coalescing_key(payload):
+    if payload["audio"]:
+        return None
+    # Answers depend on conversation history, so only questions without one are shared
+    history = await asyncio.to_thread(conversation_history, payload["session_id"])
+    if history["summary"] or history["turns"]:
+        return None
+    return normalize_query(payload["input"]), filter_key(payload["filters"])
+
+async def answer(request):
+    app = request.app
+    payload = await read_request(request)
+
+    async def run():
+        async with app["admission"].admit():
+            return await process_input_async(payload["input"], get_knowledge_base(), payload["session_id"], payload["filters"])
+
+    try:
+        (final_response, audio_file, query, response_text), coalesced = await app["coalescer"].run(await coalescing_key(payload), run)
+    except Overloaded:
+        return busy_response()
+    except asyncio.TimeoutError:
+        return timeout_response()
+    except Exception as e:
+        print(f"⚠️ Answering failed: {e!r}")
+        return backend_error_response(e)
+    finally:
+        discard_upload(payload)
+    if coalesced and payload["session_id"]:
+        # Sessions hold the English turn, as process_input_async records it for the leader
+        await asyncio.to_thread(record_turn, payload["session_id"], query, response_text)
+    return web.json_response({"answer": final_response, "audio_url": audio_url(audio_file), "coalesced": coalesced})
+
+def stream_event(event):
+    if event[0] in ("sentence", "done"):
+        return {"type": event[0], "text": event[1], "audio_url": audio_url(event[2])}
+    return {"type": event[0], "text": event[1]}
+
+async def stream_events(app, payload):
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stopped = False
+
+    def produce():
+        events = process_input_streaming(payload["input"], get_knowledge_base(), payload["session_id"], payload["filters"])
+        try:
+            for event in events:
+                loop.call_soon_threadsafe(queue.put_nowait, stream_event(event))
+                if stopped:
+                    break
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, {"type": "done", "text": f"⚠️ Error generating response: {e}", "audio_url": None})
+        finally:
+            events.close()
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    async with app["admission"].admit():
+        producer = loop.run_in_executor(app["stream_executor"], produce)
+        try:
+            while (event := await queue.get()) is not None:
+                yield event
+        finally:
+            # A disconnected client stops the pipeline at its next event
+            stopped = True
+            await producer
+
+async def stream(request):
+    payload = await read_request(request)
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    try:
+        async with aclosing(stream_events(request.app, payload)) as events:
+            async for event in events:
+                if not response.prepared:
+                    await response.prepare(request)
+                await response.write((json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8"))
+    except Overloaded:
+        return busy_response()
+    except ConnectionResetError:
+        return response
+    finally:
+        discard_upload(payload)
+    if not response.prepared:
+        await response.prepare(request)
+    await response.write_eof()
+    return response
+
+async def websocket(request):
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    async for message in ws:
+        if message.type != WSMsgType.TEXT:
+            continue
+        try:
+            payload = json.loads(message.data)
+            query = str(payload.get("query") or "").strip()
+            filters = read_filters(payload.get("filters"))
+        except (ValueError, AttributeError):
+            query = ""
+        except web.HTTPBadRequest as e:
+            await ws.send_json({"type": "error", "text": e.text})
+            continue
+        if not query:
+            await ws.send_json({"type": "error", "text": "'query' is required"})
+            continue
+        try:
+            payload = {"input": query, "session_id": payload.get("session_id") or None, "audio": False, "filters": filters}
+            async with aclosing(stream_events(request.app, payload)) as events:
+                async for event in events:
+                    await ws.send_json(event)
+        except Overloaded:
+            await ws.send_json({"type": "error", "text": BUSY_MESSAGE, "retry_after": 1})
+    return ws
+
+async def audio(request):
+    path = os.path.join(AUDIO_CACHE_DIR, os.path.basename(request.match_info["name"]))
+    if not os.path.isfile(path):
+        raise web.HTTPNotFound()
+    headers = {"Content-Type": audio_mime_type(path), "Cache-Control": "public, max-age=86400"}
+    if request.query.get("download"):
+        headers["Content-Disposition"] = f'attachment; filename="chat_response{os.path.splitext(path)[1]}"'
+    return web.FileResponse(path, headers=headers)
+
+async def healthz(request):
+    return web.json_response({"status": "ok", "pid": os.getpid(), **request.app["admission"].stats()})
+
+async def readyz(request):
+    state = await asyncio.to_thread(get_knowledge_base().get)
+    if state is None:
+        return web.json_response({"status": "loading"}, status=503)
+    return web.json_response({"status": "ready", "version": state["version"]})
+
+async def sources(request):
+    state = await asyncio.to_thread(get_knowledge_base().get)
+    return web.json_response({"sources": document_sources(state)})
+
+async def traces(request):
+    return web.json_response(recent_traces(), dumps=lambda value: json.dumps(value, ensure_ascii=False, default=str))
+
+async def metrics(request):
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+async def warm_up(app):
+    setup_tracing()
+    await asyncio.to_thread(get_knowledge_base().get)
+
+async def shut_down(app):
+    app["stream_executor"].shutdown(wait=False)
+    await close_http_sessions()
+
+def create_app(max_active=QA_MAX_ACTIVE, max_queue=QA_MAX_QUEUE, queue_timeout=QA_QUEUE_TIMEOUT_SECONDS):
+    app = web.Application(client_max_size=int(QA_MAX_UPLOAD_MB * 2 ** 20))
+    app["admission"] = AdmissionController(max_active, max_queue, queue_timeout)
+    app["coalescer"] = RequestCoalescer()
+    app["stream_executor"] = ThreadPoolExecutor(max_workers=max_active)
+    app.router.add_post("/v1/answer", answer)
+    app.router.add_post("/v1/stream", stream)
+    app.router.add_get("/v1/ws", websocket)
+    app.router.add_get("/v1/audio/{name}", audio)
+    app.router.add_get("/v1/sources", sources)
+    app.router.add_get("/v1/traces", traces)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+    app.router.add_get("/metrics", metrics)
+    app.on_startup.append(warm_up)
+    app.on_cleanup.append(shut_down)
+    return app
+
+def run_worker(host, port, reuse_port, max_active, max_queue, queue_timeout):
+    web.run_app(create_app(max_active, max_queue, queue_timeout), host=host, port=port, reuse_port=reuse_port,
+                print=lambda message: print(f"✓ Worker {os.getpid()}: {message.splitlines()[0]}"))
+
+def serve(host=QA_SERVER_HOST, port=QA_SERVER_PORT, workers=QA_SERVER_WORKERS, max_active=QA_MAX_ACTIVE,
+          max_queue=QA_MAX_QUEUE, queue_timeout=QA_QUEUE_TIMEOUT_SECONDS):
+    if workers <= 1:
+        run_worker(host, port, False, max_active, max_queue, queue_timeout)
+        return
+    # Workers share the port through SO_REUSEPORT and the index through the page cache
+    processes = [multiprocessing.Process(target=run_worker, args=(host, port, True, max_active, max_queue, queue_timeout))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Serve the question-answering pipeline over HTTP and WebSocket.")
+    parser.add_argument("--host", default=QA_SERVER_HOST)
+    parser.add_argument("--port", type=int, default=QA_SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=QA_SERVER_WORKERS, help="server processes sharing the port")
+    parser.add_argument("--max-active", type=int, default=QA_MAX_ACTIVE, help="requests processed at once per worker")
+    parser.add_argument("--max-queue", type=int, default=QA_MAX_QUEUE, help="requests waiting per worker before rejecting")
+    parser.add_argument("--queue-timeout", type=float, default=QA_QUEUE_TIMEOUT_SECONDS, help="seconds a request may wait for a slot")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    serve(args.host, args.port, args.workers, args.max_active, args.max_queue, args.queue_timeout)
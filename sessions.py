@@ -0,0 +1,140 @@
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class InMemoryConversationStore:
+    def __init__(self, max_sessions=1000, idle_ttl=3600, max_turns=50):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_turns = max_turns
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def evict(self):
+        cutoff = time.time() - self.idle_ttl
+        while self.sessions:
+            session_id, conversation = next(iter(self.sessions.items()))
+            if len(self.sessions) <= self.max_sessions and conversation["touched"] >= cutoff:
+                break
+            del self.sessions[session_id]
+
+    def get(self, session_id):
+        with self.lock:
+            conversation = self.sessions.get(session_id)
+            if conversation is None:
+                return {"summary": None, "turns": []}
+            conversation["touched"] = time.time()
+            self.sessions.move_to_end(session_id)
+            return {"summary": conversation["summary"], "turns": list(conversation["turns"])}
+
+    def append(self, session_id, user_msg, bot_msg):
+        with self.lock:
+            conversation = self.sessions.setdefault(session_id, {"summary": None, "turns": [], "touched": 0})
+            conversation["turns"].append((user_msg, bot_msg))
+            del conversation["turns"][:-self.max_turns]
+            conversation["touched"] = time.time()
+            self.sessions.move_to_end(session_id)
+            self.evict()
+
+    def compact(self, session_id, summary, keep_turns):
+        with self.lock:
+            conversation = self.sessions.get(session_id)
+            if conversation is not None:
+                conversation["summary"] = summary
+                del conversation["turns"][:-keep_turns or None]
+
+    def clear(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+
+class SQLiteConversationStore:
+    def __init__(self, path="conversations.db", max_sessions=1000, idle_ttl=3600, max_turns=50):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_turns = max_turns
+        self.local = threading.local()
+        with self.connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, summary TEXT, touched REAL)")
+            db.execute("CREATE TABLE IF NOT EXISTS turns (session_id TEXT, seq INTEGER PRIMARY KEY AUTOINCREMENT, user_msg TEXT, bot_msg TEXT)")
+            db.execute("CREATE INDEX IF NOT EXISTS turns_session ON turns (session_id, seq)")
+            db.execute("CREATE INDEX IF NOT EXISTS sessions_touched ON sessions (touched)")
+
+    def connect(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            self.local.db = db
+        return db
+
+    def evict(self, db):
+        stale = db.execute(
+            "SELECT id FROM sessions WHERE touched < ? OR id NOT IN "
+            "(SELECT id FROM sessions ORDER BY touched DESC LIMIT ?)",
+            (time.time() - self.idle_ttl, self.max_sessions),
+        ).fetchall()
+        for (session_id,) in stale:
+            db.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def get(self, session_id):
+        with self.connect() as db:
+            row = db.execute("SELECT summary FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                return {"summary": None, "turns": []}
+            db.execute("UPDATE sessions SET touched = ? WHERE id = ?", (time.time(), session_id))
+            turns = db.execute(
+                "SELECT user_msg, bot_msg FROM turns WHERE session_id = ? ORDER BY seq", (session_id,)
+            ).fetchall()
+            return {"summary": row[0], "turns": turns}
+
+    def append(self, session_id, user_msg, bot_msg):
+        with self.connect() as db:
+            db.execute(
+                "INSERT INTO sessions (id, summary, touched) VALUES (?, NULL, ?) "
+                "ON CONFLICT(id) DO UPDATE SET touched = excluded.touched",
+                (session_id, time.time()),
+            )
+            db.execute("INSERT INTO turns (session_id, user_msg, bot_msg) VALUES (?, ?, ?)", (session_id, user_msg, bot_msg))
+            self.trim(db, session_id, self.max_turns)
+            self.evict(db)
+
+    def trim(self, db, session_id, keep_turns):
+        db.execute(
+            "DELETE FROM turns WHERE session_id = ? AND seq NOT IN "
+            "(SELECT seq FROM turns WHERE session_id = ? ORDER BY seq DESC LIMIT ?)",
+            (session_id, session_id, keep_turns),
+        )
+
+    def compact(self, session_id, summary, keep_turns):
+        with self.connect() as db:
+            db.execute("UPDATE sessions SET summary = ? WHERE id = ?", (summary, session_id))
+            self.trim(db, session_id, keep_turns)
+
+    def clear(self, session_id):
+        with self.connect() as db:
+            db.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+
+def create_conversation_store(backend="memory", path="conversations.db", max_sessions=1000, idle_ttl=3600, max_turns=50):
+    if backend == "sqlite":
+        return SQLiteConversationStore(path, max_sessions, idle_ttl, max_turns)
+    if backend == "memory":
+        return InMemoryConversationStore(max_sessions, idle_ttl, max_turns)
+    raise ValueError(f"Unknown conversation store backend {backend!r}, expected 'memory' or 'sqlite'")
+
+def history_window(conversation, token_budget, count_tokens):
+    turns = []
+    used = count_tokens(conversation["summary"]) if conversation["summary"] else 0
+    for user_msg, bot_msg in reversed(conversation["turns"]):
+        used += count_tokens(user_msg) + count_tokens(bot_msg)
+        if used > token_budget:
+            break
+        turns.append((user_msg, bot_msg))
+    turns.reverse()
+    return {"summary": conversation["summary"], "turns": turns}
@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import uuid
+import functools
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in items) + "}"
+
+
+class Metrics:
+    def __init__(self, namespace="maharastra", buckets=DURATION_BUCKETS):
+        self.namespace = namespace
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def render(self):
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = f"{self.namespace}_{name}"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metric = f"{self.namespace}_{name}"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} histogram")
+                    typed.add(metric)
+                for bound, count in zip(self.buckets, histogram["buckets"]):
+                    lines.append(f"{metric}_bucket{format_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{metric}_bucket{format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+                lines.append(f"{metric}_sum{format_labels(labels)} {histogram['sum']:.6f}")
+                lines.append(f"{metric}_count{format_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+class Trace:
+    def __init__(self, name, attributes):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attributes = dict(attributes)
+        self.spans = []
+        self.counters = {}
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration_ms = None
+        self.error = None
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "error": self.error,
+            "attributes": self.attributes,
+            "counters": self.counters,
+            "spans": sorted(self.spans, key=lambda span: span["start_ms"]),
+        }
+
+
+class Tracer:
+    def __init__(self, metrics, history=50):
+        self.metrics = metrics
+        self.recent = deque(maxlen=history)
+        self.logger = None
+
+    def configure(self, log_path=None, log_max_bytes=50 * 2 ** 20, history=None):
+        if history is not None and history != self.recent.maxlen:
+            self.recent = deque(self.recent, maxlen=history)
+        if log_path and self.logger is None:
+            os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+            logger = logging.getLogger("maharastra.traces")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            handler = RotatingFileHandler(log_path, maxBytes=log_max_bytes, backupCount=3, encoding="utf-8", delay=True)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            self.logger = logger
+
+    @contextmanager
+    def trace(self, name, **attributes):
+        trace = Trace(name, attributes)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        except Exception as e:
+            trace.error = repr(e)
+            raise
+        finally:
+            trace.duration_ms = round((time.perf_counter() - trace.started) * 1000, 3)
+            try:
+                _current_trace.reset(token)
+            except ValueError:
+                # generator-based pipelines may be closed from another context
+                pass
+            self.finish(trace)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        trace = _current_trace.get()
+        started = time.perf_counter()
+        span = {
+            "name": name,
+            "start_ms": round((started - trace.started) * 1000, 3) if trace is not None else 0.0,
+            "duration_ms": None,
+            "attributes": attributes,
+        }
+        try:
+            yield span
+        except Exception as e:
+            span["error"] = repr(e)
+            self.metrics.increment("errors_total", stage=name)
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            span["duration_ms"] = round(duration * 1000, 3)
+            self.metrics.observe("stage_duration_seconds", duration, stage=name)
+            if trace is not None:
+                trace.spans.append(span)
+
+    def annotate(self, **attributes):
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.attributes.update(attributes)
+
+    def count(self, name, value=1, **labels):
+        self.metrics.increment(f"{name}_total", value, **labels)
+        trace = _current_trace.get()
+        if trace is not None and value:
+            key = ".".join([name] + [str(label) for label in labels.values()])
+            trace.counters[key] = trace.counters.get(key, 0) + value
+
+    def finish(self, trace):
+        self.metrics.observe("request_duration_seconds", trace.duration_ms / 1000, pipeline=trace.name)
+        self.metrics.increment("requests_total", pipeline=trace.name, status="error" if trace.error else "ok")
+        record = trace.to_dict()
+        self.recent.append(record)
+        if self.logger is not None:
+            self.logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+metrics = Metrics()
+tracer = Tracer(metrics)
+trace = tracer.trace
+span = tracer.span
+annotate = tracer.annotate
+count = tracer.count
+configure = tracer.configure
+
+def isolated_context(generator_function):
+    # A generator runs in its consumer's context, so a trace opened inside it would leak into the consumer between
+    # yields; each step runs in a private copy of the context instead
+    @functools.wraps(generator_function)
+    def wrapper(*args, **kwargs):
+        context = contextvars.copy_context()
+        generator = generator_function(*args, **kwargs)
+        try:
+            while True:
+                try:
+                    item = context.run(next, generator)
+                except StopIteration:
+                    return
+                yield item
+        finally:
+            context.run(generator.close)
+    return wrapper
+
+def recent_traces():
+    return list(tracer.recent)
+
+def render_metrics():
+    return metrics.render()
+
+def write_metrics_textfile(path):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(render_metrics())
+    os.replace(path + ".tmp", path)
+
+_metrics_server = None
+_metrics_lock = threading.Lock()
+
+def start_metrics_server(port, host="0.0.0.0"):
+    global _metrics_server
+    with _metrics_lock:
+        if _metrics_server is not None:
+            return _metrics_server
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = render_metrics().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            _metrics_server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as e:
+            print(f"⚠️ Metrics server could not bind port {port}: {e}")
+            return None
+        threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+        print(f"✓ Metrics available at http://{host}:{port}/metrics")
+        return _metrics_server
@@ -0,0 +1,176 @@
+import os
+import queue
+import hashlib
+import threading
+import uuid
+from contextlib import contextmanager
+from tracing import count
+
+# output format name -> (Speech SDK SpeechSynthesisOutputFormat member, file extension, mime type)
+AUDIO_FORMATS = {
+    "wav": ("Riff16Khz16BitMonoPcm", "wav", "audio/wav"),
+    "mp3": ("Audio16Khz32KBitRateMonoMp3", "mp3", "audio/mpeg"),
+    "opus": ("Ogg16Khz16BitMonoOpus", "ogg", "audio/ogg"),
+}
+MIME_TYPES = {extension: mime for _, extension, mime in AUDIO_FORMATS.values()}
+
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def audio_mime_type(path):
+    return MIME_TYPES.get(os.path.splitext(path)[1].lstrip(".").lower(), "audio/wav")
+
+
+class SynthesizerPool:
+    def __init__(self, key, region, output_format="wav", size=4):
+        self.key = key
+        self.region = region
+        self.output_format = output_format
+        self.size = size
+        self.pools = {}
+        self.created = {}
+        self.lock = threading.Lock()
+
+    def create(self, voice):
+        import azure.cognitiveservices.speech as speechsdk
+        speech_config = speechsdk.SpeechConfig(subscription=self.key, region=self.region)
+        speech_config.speech_synthesis_voice_name = voice
+        speech_config.set_speech_synthesis_output_format(
+            getattr(speechsdk.SpeechSynthesisOutputFormat, AUDIO_FORMATS[self.output_format][0])
+        )
+        return speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
+
+    @contextmanager
+    def acquire(self, voice):
+        with self.lock:
+            pool = self.pools.setdefault(voice, queue.Queue())
+            create = pool.empty() and self.created.get(voice, 0) < self.size
+            if create:
+                self.created[voice] = self.created.get(voice, 0) + 1
+        if create:
+            try:
+                synthesizer = self.create(voice)
+            except Exception:
+                with self.lock:
+                    self.created[voice] -= 1
+                raise
+        else:
+            synthesizer = pool.get()
+        try:
+            yield synthesizer
+        finally:
+            pool.put(synthesizer)
+
+    def speak(self, voice, text):
+        import azure.cognitiveservices.speech as speechsdk
+        with self.acquire(voice) as synthesizer:
+            result = synthesizer.speak_text_async(text).get()
+        if result.reason != speechsdk.ResultReason.SynthesizingAudioCompleted:
+            print(f"⚠️ Speech synthesis error: {result.reason}")
+            return None
+        return result.audio_data
+
+
+class AudioCache:
+    def __init__(self, directory="output/audio", max_bytes=500 * 2 ** 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def path_for(self, *parts, extension="wav"):
+        digest = hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.{extension}")
+
+    def get(self, path):
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            return None
+
+    def put(self, path, data):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        with self.lock:
+            # Names are content hashes, so a concurrent synthesis of the same text replaces an identical file
+            try:
+                replaced = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+            self.total_bytes += len(data) - replaced
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+        return path
+
+    def evict(self):
+        entries = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.is_file() and not entry.name.endswith(".tmp")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        self.total_bytes = sum(entry.stat().st_size for entry in entries)
+        target = self.max_bytes * 0.9
+        for entry in entries:
+            if self.total_bytes <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self.total_bytes -= size
+            except FileNotFoundError:
+                pass
+
+
+class SpeechService:
+    def __init__(self, key, region, output_format="wav", cache_dir="output/audio", max_bytes=500 * 2 ** 20, pool_size=4):
+        if output_format not in AUDIO_FORMATS:
+            raise ValueError(f"Unknown audio format {output_format!r}, expected one of {', '.join(AUDIO_FORMATS)}")
+        self.output_format = output_format
+        self.extension = AUDIO_FORMATS[output_format][1]
+        self.pool = SynthesizerPool(key, region, output_format, pool_size)
+        self.cache = AudioCache(cache_dir, max_bytes)
+        self.hits = 0
+        self.misses = 0
+
+    def synthesize(self, text, voice):
+        path = self.cache.path_for(voice, self.output_format, text, extension=self.extension)
+        if self.cache.get(path):
+            self.hits += 1
+            count("cache_hits", cache="audio")
+            return path
+        self.misses += 1
+        count("cache_misses", cache="audio")
+        audio_data = self.pool.speak(voice, text)
+        if audio_data is None:
+            return None
+        return self.cache.put(path, audio_data)
+
+    def combine(self, paths):
+        if len(paths) == 1:
+            return paths[0]
+        path = self.cache.path_for(*paths, extension=self.extension)
+        if self.cache.get(path):
+            return path
+        if self.extension == "wav":
+            import io
+            import wave
+            buffer = io.BytesIO()
+            with wave.open(buffer, "wb") as combined:
+                for i, clip_path in enumerate(paths):
+                    with wave.open(clip_path, "rb") as clip:
+                        if i == 0:
+                            combined.setparams(clip.getparams())
+                        combined.writeframes(clip.readframes(clip.getnframes()))
+            data = buffer.getvalue()
+        else:
+            # MP3 frames and Ogg pages can be concatenated as-is
+            data = b"".join(read_file(clip_path) for clip_path in paths)
+        return self.cache.put(path, data)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "bytes": self.cache.total_bytes}
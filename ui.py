@@ -1,29 +1,75 @@
 import os
+import uuid
 import base64
 import streamlit as st
-import speech_recognition as sr
-from main import process_input
+import streamlit.components.v1 as components
+from tts import audio_mime_type
 from datetime import datetime
 
+DEBUG_TRACE_COUNT = int(os.getenv("DEBUG_TRACE_COUNT", "10"))
+QA_SERVER_URL = os.getenv("QA_SERVER_URL", "")
+# Address browsers can reach the server on; when set, answer audio streams straight from it
+QA_SERVER_PUBLIC_URL = os.getenv("QA_SERVER_PUBLIC_URL", "")
+CHAT_HISTORY_LIMIT = int(os.getenv("CHAT_HISTORY_LIMIT", "200"))
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "20"))
+
 st.set_page_config(page_title="🗣️ VerbalAI Chatbot", layout="wide")
 
+if QA_SERVER_URL:
+    # Thin client: answering runs in server.py, which scales separately from the UI
+    from client import QAClient
+
+    @st.cache_resource(show_spinner=False)
+    def qa_client():
+        return QAClient(QA_SERVER_URL, public_url=QA_SERVER_PUBLIC_URL)
+
+    process_input, process_input_streaming = qa_client().process_input, qa_client().process_input_streaming
+    recent_traces, render_metrics = qa_client().recent_traces, qa_client().render_metrics
+
+    def shared_knowledge_base():
+        return None
+
+    @st.cache_data(ttl=300, show_spinner=False)
+    def available_sources():
+        return qa_client().sources()
+else:
+    from main import process_input, process_input_streaming, get_knowledge_base, document_sources
+    from tracing import recent_traces, render_metrics
+
+    # One knowledge base per server process, loaded on the first query
+    @st.cache_resource(show_spinner=False)
+    def shared_knowledge_base():
+        return get_knowledge_base()
+
+    @st.cache_data(ttl=300, show_spinner=False)
+    def available_sources():
+        return document_sources(shared_knowledge_base().get())
+
 # Set transparent background wallpaper
-def get_base64_of_image(image_path):
-    with open(image_path, "rb") as img_file:
-        return base64.b64encode(img_file.read()).decode()
-
-if os.path.exists("wallpaper.png"):
-    wallpaper_base64 = get_base64_of_image("wallpaper.png")
-    st.markdown(
-        f"""
-        <style>
+WALLPAPER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "wallpaper.png")
+
+@st.cache_data(show_spinner=False)
+def wallpaper_url():
+    # With static serving the browser fetches and caches the image once instead of every rerun inlining it
+    if st.get_option("server.enableStaticServing"):
+        return "app/static/wallpaper.png"
+    with open(WALLPAPER_PATH, "rb") as img_file:
+        return f"data:image/png;base64,{base64.b64encode(img_file.read()).decode()}"
+
+@st.cache_data(show_spinner=False)
+def page_style():
+    background = ""
+    if os.path.exists(WALLPAPER_PATH):
+        background = f"""
         .stApp {{
             background: linear-gradient(rgba(255,255,255,0.80), rgba(255,255,255,0.80)),
-                        url("data:image/png;base64,{wallpaper_base64}");
+                        url("{wallpaper_url()}");
             background-size: cover;
             background-repeat: no-repeat;
             background-attachment: fixed;
-        }}
+        }}"""
+    return f"""
+        <style>{background}
         .message-bubble {{
             padding: 1rem;
             border-radius: 1rem;
@@ -40,84 +86,219 @@ if os.path.exists("wallpaper.png"):
             align-self: flex-start;
         }}
         </style>
-        """,
-        unsafe_allow_html=True
-    )
+        """
+
+st.markdown(page_style(), unsafe_allow_html=True)
 
 st.markdown("<h1 style='text-align: center;'>🗣️ VerbalAI Chatbot</h1>", unsafe_allow_html=True)
 
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+if "history_pages" not in st.session_state:
+    st.session_state.history_pages = 1
+
+AUDIO_UPLOAD_TYPES = ["wav", "m4a", "mp3", "ogg", "webm", "flac"]
+
+def save_audio_input(name, data):
+    os.makedirs("input", exist_ok=True)
+    path = os.path.join("input", name)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+# Play each streamed sentence clip as soon as the previous one ends
+CHAIN_AUDIO_SCRIPT = """
+<script>
+const doc = window.parent.document;
+const known = new Set(doc.querySelectorAll("audio"));
+const chain = () => {
+    const clips = Array.from(doc.querySelectorAll("audio")).filter((clip) => !known.has(clip));
+    clips.forEach((clip, i) => {
+        if (clip.dataset.chained) return;
+        clip.dataset.chained = "1";
+        clip.addEventListener("ended", () => {
+            const next = Array.from(doc.querySelectorAll("audio")).filter((c) => !known.has(c))[i + 1];
+            if (next) next.play();
+        });
+    });
+};
+new MutationObserver(chain).observe(doc.body, {childList: true, subtree: true});
+</script>
+"""
+
+def message_html(role, message, msg_type, time):
+    style_class = "user-message" if msg_type == "user" else "bot-message"
+    alignment = "right" if msg_type == "user" else "left"
+    avatar = "🧑" if msg_type == "user" else "🤖"
+    return (
+        f"<div style='display: flex; justify-content: {alignment};'>"
+        f"<div class='message-bubble {style_class}'>"
+        f"<strong>{avatar} {role}</strong><br>{message}<br><small>{time}</small>"
+        f"</div></div>"
+    )
 
-def recognize_speech():
-    recognizer = sr.Recognizer()
-    with sr.Microphone() as source:
-        with st.spinner("🎤 Listening... Speak now!"):
-            recognizer.adjust_for_ambient_noise(source)
-            audio = recognizer.listen(source, timeout=10, phrase_time_limit=15)
-    try:
-        return recognizer.recognize_google(audio)
-    except Exception as e:
-        st.error(f"❌ Could not recognize speech: {e}")
-        return None
-
-def display_response(user_input_or_file):
+def render_message(role, message, msg_type, time, container=st):
+    container.markdown(message_html(role, message, msg_type, time), unsafe_allow_html=True)
+
+def render_messages(entries, container=st):
+    if entries:
+        container.markdown("".join(message_html(*entry) for entry in entries), unsafe_allow_html=True)
+
+def append_history(*entries):
+    history = st.session_state.chat_history
+    history.extend(entries)
+    excess = len(history) - CHAT_HISTORY_LIMIT
+    if excess > 0:
+        del history[:excess]
+        st.session_state.rendered_upto = max(0, st.session_state.get("rendered_upto", 0) - excess)
+
+def show_earlier_messages():
+    st.session_state.history_pages += 1
+
+def render_history():
+    history = st.session_state.chat_history
+    # Pages start at fixed positions, so unchanged pages are identical between reruns and the browser keeps them
+    start = max(0, len(history) - st.session_state.history_pages * CHAT_PAGE_SIZE) // CHAT_PAGE_SIZE * CHAT_PAGE_SIZE
+    if start:
+        st.button(f"⬆️ Show earlier messages ({start})", on_click=show_earlier_messages, use_container_width=True)
+    for page in range(start, len(history), CHAT_PAGE_SIZE):
+        render_messages(history[page:page + CHAT_PAGE_SIZE])
+    st.session_state.rendered_upto = len(history)
+
+def audio_source(audio):
+    if audio and (audio.startswith(("http://", "https://")) or os.path.exists(audio)):
+        return audio
+    return None
+
+def render_audio(audio, player=True):
+    if player:
+        st.audio(audio, format=audio_mime_type(audio))
+    if audio.startswith(("http://", "https://")):
+        # The browser streams the file from the answering server, nothing passes through this process
+        st.markdown(f"<a href='{audio}?download=1'>⬇️ Download Response Audio</a>", unsafe_allow_html=True)
+    elif not player:
+        # Streamed answers already played sentence by sentence, so the combined file is offered as a download
+        with open(audio, "rb") as f:
+            st.download_button("⬇️ Download Response Audio", f.read(), f"chat_response{os.path.splitext(audio)[1]}",
+                               audio_mime_type(audio))
+
+def stream_response(user_input_or_file, timestamp, user_bubble, filters=None):
+    bubble = st.empty()
+    render_message("🤖 Chatbot", "▌", "bot", timestamp, bubble)
+    components.html(CHAIN_AUDIO_SCRIPT, height=0)
+    clips = st.container()
+
+    language, shown, clip_count = "en", "", 0
+    transcript, response_text, voice_filename = None, "", None
+    for event in process_input_streaming(user_input_or_file, shared_knowledge_base(), st.session_state.session_id, filters):
+        if event[0] == "transcript":
+            transcript = event[1]
+            render_message("🧑 You", f"🎵 {transcript}▌", "user", timestamp, user_bubble)
+        elif event[0] == "language":
+            language = event[1]
+        elif event[0] == "token" and language == "en":
+            shown += event[1]
+            render_message("🤖 Chatbot", shown + "▌", "bot", timestamp, bubble)
+        elif event[0] == "sentence":
+            if language != "en":
+                shown += event[1] + " "
+                render_message("🤖 Chatbot", shown + "▌", "bot", timestamp, bubble)
+            if audio_source(event[2]):
+                clips.audio(event[2], format=audio_mime_type(event[2]), autoplay=clip_count == 0)
+                clip_count += 1
+        elif event[0] == "done":
+            response_text, voice_filename = event[1], event[2]
+    render_message("🤖 Chatbot", response_text, "bot", timestamp, bubble)
+    return transcript, response_text, voice_filename
+
+def display_response(user_input_or_file, stream=False, filters=None):
     if user_input_or_file:
-        with st.spinner("🤖 Generating response..."):
-            response_text, voice_filename = process_input(user_input_or_file)
-            timestamp = datetime.now().strftime("%H:%M")
-
-            st.session_state.chat_history.append(("🧑 You", user_input_or_file if isinstance(user_input_or_file, str) else "🎵 Audio File", "user", timestamp))
-            st.session_state.chat_history.append(("🤖 Chatbot", response_text, "bot", timestamp))
-
-        for role, message, msg_type, time in st.session_state.chat_history:
-            style_class = "user-message" if msg_type == "user" else "bot-message"
-            alignment = "right" if msg_type == "user" else "left"
-            avatar = "🧑" if msg_type == "user" else "🤖"
-            st.markdown(
-                f"<div style='display: flex; justify-content: {alignment};'>"
-                f"<div class='message-bubble {style_class}'>"
-                f"<strong>{avatar} {role}</strong><br>{message}<br><small>{time}</small>"
-                f"</div></div>",
-                unsafe_allow_html=True
+        timestamp = datetime.now().strftime("%H:%M")
+        user_message = user_input_or_file if isinstance(user_input_or_file, str) else "🎵 Audio File"
+
+        if stream:
+            user_bubble = st.empty()
+            render_message("🧑 You", user_message, "user", timestamp, user_bubble)
+            transcript, response_text, voice_filename = stream_response(user_input_or_file, timestamp, user_bubble, filters)
+            if transcript:
+                user_message = f"🎵 {transcript}"
+                render_message("🧑 You", user_message, "user", timestamp, user_bubble)
+        else:
+            with st.spinner("🤖 Generating response..."):
+                response_text, voice_filename = process_input(user_input_or_file, shared_knowledge_base(), st.session_state.session_id, filters)
+            render_messages([("🧑 You", user_message, "user", timestamp), ("🤖 Chatbot", response_text, "bot", timestamp)])
+        append_history(("🧑 You", user_message, "user", timestamp), ("🤖 Chatbot", response_text, "bot", timestamp))
+
+        # Only the latest answer gets audio; a local file is loaded once, for the player (whose menu offers the
+        # download) or, after streaming, for a download button
+        if audio_source(voice_filename):
+            render_audio(voice_filename, player=not stream)
+
+def render_debug_panel(limit=DEBUG_TRACE_COUNT):
+    traces = recent_traces()[-limit:]
+    with st.expander(f"🛠️ Debug: last {len(traces)} requests"):
+        if not traces:
+            st.caption("No requests traced yet.")
+        for record in reversed(traces):
+            language = record["attributes"].get("language", "")
+            st.markdown(f"**{record['name']}** · {record['duration_ms']:.0f} ms · {language} · `{record['trace_id']}`")
+            st.dataframe(
+                [{"stage": span["name"], "start_ms": span["start_ms"], "duration_ms": span["duration_ms"],
+                  "error": span.get("error", "")} for span in record["spans"]],
+                hide_index=True, use_container_width=True
             )
-
-        if os.path.exists(voice_filename):
-            st.audio(voice_filename, format="audio/wav")
-            with open(voice_filename, "rb") as file:
-                st.download_button("⬇️ Download Response Audio", file, "chat_response.wav", "audio/wav")
+            if record["counters"]:
+                st.json(record["counters"], expanded=False)
+        st.code(render_metrics(), language="text")
 
 # Sidebar Input Selector
 with st.sidebar:
     st.header("🎛️ Select Input Mode")
     input_option = st.radio("", ("Text", "Live Voice", "Upload Audio File"))
+    stream_responses = st.toggle("⚡ Stream responses", value=True)
+    sources = available_sources()
+    search_source = st.selectbox("📚 Search in", ["All documents"] + sources) if len(sources) > 1 else "All documents"
+    search_filters = {"source": search_source} if search_source != "All documents" else None
     st.markdown("---")
-    st.caption("🔊 Audio types supported: WAV, M4A")
+    st.caption(f"🔊 Audio types supported: {', '.join(t.upper() for t in AUDIO_UPLOAD_TYPES)}")
     st.caption("🏁 Tip: Keep queries short and clear")
     st.markdown("Made with ❤️ using Streamlit")
 
-st.markdown("## 🧠 Chat with VerbalAI")
+@st.fragment
+def chat_area(input_option, stream, filters):
+    # Submitting reruns only this fragment: earlier pages stay as they are and just the new turns are drawn
+    render_messages(st.session_state.chat_history[st.session_state.rendered_upto:])
+    chat = st.container()
+
+    if input_option == "Text":
+        user_input = st.text_input("💬 Enter your query:")
+        if st.button("🚀 Submit", use_container_width=True):
+            with chat:
+                display_response(user_input, stream, filters)
+
+    elif input_option == "Live Voice":
+        # Recorded in the browser, so the script is never blocked waiting on a microphone
+        recording = st.audio_input("🎙️ Record your question")
+        if recording and st.button("🚀 Submit", use_container_width=True):
+            voice_path = save_audio_input(f"voice_{datetime.now().strftime('%Y%m%d%H%M%S')}.wav", recording.getvalue())
+            with chat:
+                display_response(voice_path, stream, filters)
+
+    elif input_option == "Upload Audio File":
+        uploaded_file = st.file_uploader("📤 Upload an audio file", type=AUDIO_UPLOAD_TYPES)
+        if uploaded_file and st.button("🔍 Process Audio", use_container_width=True):
+            with chat:
+                display_response(save_audio_input(uploaded_file.name, uploaded_file.read()), stream, filters)
 
-# Input Options
-if input_option == "Text":
-    user_input = st.text_input("💬 Enter your query:")
-    if st.button("🚀 Submit", use_container_width=True):
-        display_response(user_input)
-
-elif input_option == "Live Voice":
-    if st.button("🎙️ Start Recording", use_container_width=True):
-        user_input = recognize_speech()
-        if user_input:
-            display_response(user_input)
-
-elif input_option == "Upload Audio File":
-    uploaded_file = st.file_uploader("📤 Upload a WAV or M4A file", type=["wav", "m4a"])
-    if uploaded_file and st.button("🔍 Process Audio", use_container_width=True):
-        temp_file_path = os.path.join("input", uploaded_file.name)
-        with open(temp_file_path, "wb") as f:
-            f.write(uploaded_file.read())
-        display_response(temp_file_path)
+st.markdown("## 🧠 Chat with VerbalAI")
+render_history()
+chat_area(input_option, stream_responses, search_filters)
 
+# Hidden latency breakdown, shown with ?debug=1 or DEBUG_PANEL=1
+if st.query_params.get("debug") == "1" or os.getenv("DEBUG_PANEL", "").lower() in ("1", "true", "yes"):
+    render_debug_panel()
 
 
 
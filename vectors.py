@@ -1,13 +1,32 @@
 
 import os
+import sys
+import glob
+import json
+import base64
+import argparse
 import faiss
 import pickle
+import shutil
+import hashlib
+import random
+import threading
+import contextvars
 import numpy as np
 import openai
 import time
 import fitz  # PyMuPDF
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dotenv import load_dotenv
 import tiktoken
+from chunk_store import (CHUNK_METADATA_FILE, ChunkStore, chunk_store_exists, current_index_dir, new_index_version,
+                         prune_index_dirs, publish_index_dir, staging_index_dir, write_chunk_store, write_index_version)
+from lexical import lexical_index_exists, write_lexical_index
+from embeddings import EMBEDDING_PROVIDERS, create_embedding_provider, normalize_embeddings
+from language import LanguageDetector
+from reranking import CrossEncoderReranker
+from tracing import annotate, configure as configure_tracing, count, span, trace, write_metrics_textfile
 
 
 load_dotenv()
@@ -19,129 +38,850 @@ AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION")
 AZURE_DEPLOYMENT_EMBEDDINGS = os.getenv("AZURE_DEPLOYMENT_EMBEDDINGS")
 
 
-FAISS_INDEX_PATH = "faiss_index.bin"
-CHUNKS_FILE_PATH = "chunks.pkl"
-EMBEDDINGS_FILE_PATH = "embeddings.pkl"
+FAISS_INDEX_FILE = "faiss_index.bin"
+LEGACY_CHUNKS_FILE_PATH = "chunks.pkl"
+LEGACY_EMBEDDINGS_FILE_PATH = "embeddings.pkl"
+MANIFEST_FILE = "manifest.json"
+EMBEDDING_JOURNAL_FILE = "embeddings.journal"
 LOCAL_PDF_FILE_PATH = "input.pdf"
 
+INDEX_DIR = os.getenv("INDEX_DIR", "indexes")
+INDEX_KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "3"))
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+INGEST_PAGES_PER_SHARD = int(os.getenv("INGEST_PAGES_PER_SHARD", "16"))
+CHUNK_ENCODE_BATCH_SIZE = int(os.getenv("CHUNK_ENCODE_BATCH_SIZE", "64"))
+
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "4"))
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "16"))
+EMBEDDING_MAX_BATCH_TOKENS = int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", "8000"))
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", "120000"))
+EMBEDDING_REQUESTS_PER_MINUTE = int(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", "720"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "azure")
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+LOCAL_EMBEDDING_BACKEND = os.getenv("LOCAL_EMBEDDING_BACKEND", "torch")
+LOCAL_EMBEDDING_QUANTIZE = os.getenv("LOCAL_EMBEDDING_QUANTIZE", "false").lower() in ("1", "true", "yes")
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+
+INDEX_TYPES = ("flat", "ivf-flat", "hnsw", "ivf-pq")
+# Vectors are unit length, so inner product ranks by cosine similarity
+INDEX_METRIC = "inner_product"
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+FAISS_IVF_NLIST = int(os.getenv("FAISS_IVF_NLIST", "1024"))
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "64"))
+FAISS_PQ_NBITS = int(os.getenv("FAISS_PQ_NBITS", "8"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_HNSW_EF_CONSTRUCTION = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "200"))
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+CALIBRATION_SAMPLE_SIZE = int(os.getenv("CALIBRATION_SAMPLE_SIZE", "500"))
+VECTOR_CALIBRATION_PERCENTILE = float(os.getenv("VECTOR_CALIBRATION_PERCENTILE", "50"))
+RERANK_CALIBRATION_PERCENTILE = float(os.getenv("RERANK_CALIBRATION_PERCENTILE", "95"))
+CALIBRATION_QUERY_WORDS = 8
+
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", os.path.join("logs", "traces.jsonl"))
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE", "")
+
 def setup_openai():
     openai.api_type = "azure"
     openai.api_base = AZURE_OPENAI_ENDPOINT
     openai.api_version = AZURE_OPENAI_API_VERSION
     openai.api_key = AZURE_OPENAI_API_KEY
 
-def extract_text_blocks_by_headings(file_path):
-    print(">> Extracting structured text from PDF...")
+def get_embedding_provider(provider=None):
+    return create_embedding_provider(
+        provider or EMBEDDING_PROVIDER, AZURE_DEPLOYMENT_EMBEDDINGS, LOCAL_EMBEDDING_MODEL,
+        LOCAL_EMBEDDING_BACKEND, LOCAL_EMBEDDING_QUANTIZE, LOCAL_EMBEDDING_BATCH_SIZE
+    )
+
+def resolve_pdf_paths(sources):
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths.extend(sorted(glob.glob(os.path.join(source, "**", "*.pdf"), recursive=True)))
+        elif glob.has_magic(source):
+            paths.extend(sorted(glob.glob(source, recursive=True)))
+        else:
+            paths.append(source)
+    return list(dict.fromkeys(paths))
+
+def plan_page_shards(paths, pages_per_shard=INGEST_PAGES_PER_SHARD):
+    shards = []
+    for path in paths:
+        try:
+            with fitz.open(path) as doc:
+                page_count = doc.page_count
+        except Exception as e:
+            print(f"!! Error opening PDF {path}: {e}")
+            continue
+        for start in range(0, page_count, pages_per_shard):
+            shards.append((path, start, min(start + pages_per_shard, page_count)))
+    return shards
+
+def extract_page_blocks(shard):
+    path, start, end = shard
+    blocks = []
     try:
-        doc = fitz.open(file_path)
-        all_chunks = []
-        current_chunk = ""
-
-        for page in doc:
-            blocks = page.get_text("dict")["blocks"]
-            for block in blocks:
-                if "lines" not in block:
-                    continue
-                block_text = ""
-                max_font_size = 0
+        with fitz.open(path) as doc:
+            for page_number in range(start, end):
+                for block in doc[page_number].get_text("dict")["blocks"]:
+                    if "lines" not in block:
+                        continue
+                    spans = [span for line in block["lines"] for span in line["spans"]]
+                    block_text = " ".join(span["text"].strip() for span in spans).strip()
+                    max_font_size = max((span["size"] for span in spans), default=0)
+                    is_heading = max_font_size > 12 and block_text and len(block_text.split()) < 15
+                    blocks.append((page_number + 1, bool(is_heading), block_text))
+    except Exception as e:
+        print(f"!! Error parsing PDF blocks in {path} (pages {start + 1}-{end}): {e}")
+    return path, blocks
+
+def iter_page_blocks(shards, workers):
+    if workers <= 1 or len(shards) <= 1:
+        for shard in shards:
+            yield extract_page_blocks(shard)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        shards = iter(shards)
+        for shard in shards:
+            pending.append(executor.submit(extract_page_blocks, shard))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            yield pending.popleft().result()
+            for shard in shards:
+                pending.append(executor.submit(extract_page_blocks, shard))
+                break
 
-                for line in block["lines"]:
-                    for span in line["spans"]:
-                        block_text += span["text"].strip() + " "
-                        max_font_size = max(max_font_size, span["size"])
+def iter_text_blocks_by_headings(sources, workers=INGEST_WORKERS):
+    paths = resolve_pdf_paths(sources)
+    print(f">> Extracting structured text from {len(paths)} PDF(s)...")
+    current = None
 
-                block_text = block_text.strip()
+    def flush():
+        text = "".join(current["parts"]).strip()
+        if text:
+            return {
+                "text": text,
+                "source": current["source"],
+                "page_start": current["page_start"],
+                "page_end": current["page_end"],
+                "heading": current["heading"],
+            }
 
-                
-                if max_font_size > 12 and block_text and len(block_text.split()) < 15:
-                    if current_chunk:
-                        all_chunks.append(current_chunk.strip())
-                    current_chunk = block_text + "\n"
-                else:
-                    current_chunk += block_text + " "
+    for path, blocks in iter_page_blocks(plan_page_shards(paths), workers):
+        if current and current["source"] != path:
+            chunk = flush()
+            if chunk:
+                yield chunk
+            current = None
+        for page_number, is_heading, block_text in blocks:
+            if is_heading:
+                if current:
+                    chunk = flush()
+                    if chunk:
+                        yield chunk
+                current = {"source": path, "page_start": page_number, "page_end": page_number,
+                           "heading": block_text, "parts": [block_text + "\n"]}
+            else:
+                if not current:
+                    current = {"source": path, "page_start": page_number, "page_end": page_number,
+                               "heading": None, "parts": []}
+                current["parts"].append(block_text + " ")
+                current["page_end"] = page_number
 
-        if current_chunk:
-            all_chunks.append(current_chunk.strip())
+    if current:
+        chunk = flush()
+        if chunk:
+            yield chunk
 
-        return all_chunks
-    except Exception as e:
-        print(f"!! Error parsing PDF blocks: {e}")
-        return []
+def extract_text_blocks_by_headings(file_path):
+    return [chunk["text"] for chunk in iter_text_blocks_by_headings([file_path])]
+
+def token_char_offsets(encoding, tokens):
+    offsets, boundaries = [], []
+    text_len = 0
+    for token_bytes in encoding.decode_tokens_bytes(tokens):
+        continuation = 0x80 <= token_bytes[0] < 0xC0
+        offsets.append(max(0, text_len - continuation))
+        boundaries.append(not continuation)
+        text_len += sum(1 for b in token_bytes if not 0x80 <= b < 0xC0)
+    offsets.append(text_len)
+    boundaries.append(True)
+    return offsets, boundaries
+
+def token_windows(boundaries, token_count, max_tokens, overlap):
+    start = 0
+    while start < token_count:
+        end = min(start + max_tokens, token_count)
+        while end > start + 1 and not boundaries[end]:
+            end -= 1
+        yield start, end
+        if end >= token_count:
+            return
+        start = max(end - overlap, start + 1)
+        while start < end and not boundaries[start]:
+            start += 1
 
-def refine_chunks_with_token_limit(chunks, max_tokens=500, overlap=100):
+def split_chunk_by_tokens(encoding, chunk, tokens, max_tokens, overlap):
+    if len(tokens) <= max_tokens:
+        yield chunk
+        return
+    text = chunk["text"]
+    offsets, boundaries = token_char_offsets(encoding, tokens)
+    for start, end in token_windows(boundaries, len(tokens), max_tokens, overlap):
+        sub_text = text[offsets[start]:offsets[end]].strip()
+        if sub_text:
+            yield dict(chunk, text=sub_text)
+
+def refine_chunks_with_token_limit(chunks, max_tokens=500, overlap=100, batch_size=CHUNK_ENCODE_BATCH_SIZE):
+    if not 0 <= overlap < max_tokens:
+        raise ValueError("overlap must be smaller than max_tokens")
     print(">> Refining chunks by token length...")
     encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
-    final_chunks = []
+    batch = []
     for chunk in chunks:
-        words = chunk.split()
-        i = 0
-        while i < len(words):
-            sub_chunk_words = words[i:i + max_tokens]
-            sub_text = ' '.join(sub_chunk_words)
-            tokens = encoding.encode(sub_text)
-            while len(tokens) > max_tokens:
-                sub_chunk_words = sub_chunk_words[:-1]
-                sub_text = ' '.join(sub_chunk_words)
-                tokens = encoding.encode(sub_text)
-            final_chunks.append(sub_text)
-            i += max_tokens - overlap
-    return final_chunks
-
-def generate_embeddings(chunks, batch_size=10):
+        batch.append(chunk)
+        if len(batch) < batch_size:
+            continue
+        yield from refine_chunk_batch(encoding, batch, max_tokens, overlap)
+        batch = []
+    if batch:
+        yield from refine_chunk_batch(encoding, batch, max_tokens, overlap)
+
+def refine_chunk_batch(encoding, batch, max_tokens, overlap):
+    token_lists = encoding.encode_ordinary_batch([chunk["text"] for chunk in batch])
+    for chunk, tokens in zip(batch, token_lists):
+        yield from split_chunk_by_tokens(encoding, chunk, tokens, max_tokens, overlap)
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                wait = (amount - self.available) / self.rate
+            time.sleep(wait)
+
+
+RETRYABLE_EMBEDDING_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.APIError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+)
+
+def plan_embedding_batches(chunks, max_batch_size=EMBEDDING_MAX_BATCH_SIZE, max_batch_tokens=EMBEDDING_MAX_BATCH_TOKENS):
+    encoding = tiktoken.encoding_for_model("text-embedding-ada-002")
+    token_counts = [len(tokens) for tokens in encoding.encode_ordinary_batch(chunks)]
+    batches = []
+    start, batch_tokens = 0, 0
+    for i, count in enumerate(token_counts):
+        if i > start and (i - start >= max_batch_size or batch_tokens + count > max_batch_tokens):
+            batches.append((start, i, batch_tokens))
+            start, batch_tokens = i, 0
+        batch_tokens += count
+    if start < len(chunks):
+        batches.append((start, len(chunks), batch_tokens))
+    return batches
+
+def retry_delay(attempt, error):
+    headers = getattr(error, "headers", None) or {}
+    retry_after = headers.get("Retry-After") or headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return min(60.0, 2 ** attempt) * random.uniform(0.5, 1.0)
+
+def embed_batch(batch, batch_tokens, token_bucket, request_bucket, provider):
+    for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+        request_bucket.acquire()
+        token_bucket.acquire(batch_tokens)
+        try:
+            return list(provider.embed(batch))
+        except RETRYABLE_EMBEDDING_ERRORS as e:
+            if attempt == EMBEDDING_MAX_RETRIES:
+                raise
+            delay = retry_delay(attempt, e)
+            count("retries", operation="embedding", error=e.__class__.__name__)
+            print(f"!! Embedding error ({e.__class__.__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def check_batch_size(batch_embeddings, expected):
+    # A short response would shift every later vector onto the wrong chunk
+    if len(batch_embeddings) != expected:
+        raise ValueError(f"provider returned {len(batch_embeddings)} embeddings for {expected} chunks")
+    return batch_embeddings
+
+def generate_local_embeddings(chunks, provider, on_batch=None):
+    print(f">> Generating embeddings locally with {provider.name}...")
+    embeddings = []
+    try:
+        provider.warm_up()
+        started = time.monotonic()
+        step = provider.batch_size * 8
+        for start in range(0, len(chunks), step):
+            batch = chunks[start:start + step]
+            batch_embeddings = check_batch_size(provider.embed(batch), len(batch))
+            if on_batch:
+                on_batch(start, start + len(batch), batch_embeddings)
+            embeddings.extend(batch_embeddings)
+            elapsed = max(time.monotonic() - started, 1e-6)
+            print(f"✓ Embedded {len(embeddings)}/{len(chunks)} chunks ({len(embeddings) / elapsed:.1f} chunks/s)")
+    except Exception as e:
+        print(f"!! Local embedding error: {e}")
+        return None
+    return embeddings
+
+def generate_embeddings(chunks, workers=EMBEDDING_WORKERS, provider=None, on_batch=None):
+    provider = provider or get_embedding_provider()
+    if provider.kind == "local":
+        return generate_local_embeddings(chunks, provider, on_batch)
     print(">> Generating embeddings...")
     setup_openai()
-    embeddings = []
-    for i in range(0, len(chunks), batch_size):
-        batch = chunks[i:i + batch_size]
+    batches = plan_embedding_batches(chunks)
+    embeddings = [None] * len(chunks)
+    token_bucket = TokenBucket(EMBEDDING_TOKENS_PER_MINUTE)
+    request_bucket = TokenBucket(EMBEDDING_REQUESTS_PER_MINUTE)
+    progress = {"chunks": 0, "tokens": 0, "failed": 0}
+    progress_lock = threading.Lock()
+    started = time.monotonic()
+
+    def run(batch_number, start, end, batch_tokens):
         try:
-            response = openai.Embedding.create(
-                deployment_id=AZURE_DEPLOYMENT_EMBEDDINGS,
-                input=batch
+            batch_embeddings = check_batch_size(embed_batch(chunks[start:end], batch_tokens, token_bucket, request_bucket, provider),
+                                                end - start)
+            if on_batch:
+                on_batch(start, end, batch_embeddings)
+            embeddings[start:end] = batch_embeddings
+        except Exception as e:
+            print(f"!! Embedding error on batch {batch_number}: {e}")
+            with progress_lock:
+                progress["failed"] += end - start
+            return
+        count("tokens", batch_tokens, kind="embedding")
+        with progress_lock:
+            progress["chunks"] += end - start
+            progress["tokens"] += batch_tokens
+            elapsed = max(time.monotonic() - started, 1e-6)
+            print(
+                f"✓ Processed batch {batch_number}/{len(batches)} "
+                f"({progress['chunks']}/{len(chunks)} chunks, "
+                f"{progress['chunks'] / elapsed:.1f} chunks/s, {progress['tokens'] / elapsed:.0f} tokens/s)"
             )
-            batch_embeddings = [item["embedding"] for item in response["data"]]
-            embeddings.extend(batch_embeddings)
-            print(f"✓ Processed batch {i // batch_size + 1}")
-            time.sleep(1)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch_number, (start, end, batch_tokens) in enumerate(batches, 1):
+            executor.submit(contextvars.copy_context().run, run, batch_number, start, end, batch_tokens)
+
+    if progress["failed"]:
+        print(f"!! {progress['failed']} chunks could not be embedded and will be skipped.")
+    return embeddings if progress["chunks"] else None
+
+class EmbeddingJournal:
+    def __init__(self, path, provider_name):
+        self.path = path
+        self.provider_name = provider_name
+        self.file = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        # Batches are appended one line at a time, so a crash can only tear the last line
+        embeddings, good_offset = {}, 0
+        if not os.path.exists(self.path):
+            return embeddings
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("unterminated line")
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                good_offset += len(line)
+                # Vectors from another provider cannot be mixed into this index
+                if record["provider"] != self.provider_name:
+                    continue
+                vectors = np.frombuffer(base64.b64decode(record["embeddings"]), dtype=np.float32)
+                embeddings.update(zip(record["hashes"], vectors.reshape(len(record["hashes"]), -1)))
+        if good_offset < os.path.getsize(self.path):
+            print(f"!! Discarding a partial batch at the end of {self.path}")
+            with open(self.path, "r+b") as f:
+                f.truncate(good_offset)
+        return embeddings
+
+    def append(self, hashes, embeddings):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        line = json.dumps({"provider": self.provider_name, "hashes": list(hashes),
+                           "embeddings": base64.b64encode(vectors.tobytes()).decode("ascii")}) + "\n"
+        with self.lock:
+            if self.file is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self.file = open(self.path, "a", encoding="utf-8")
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def discard(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def chunk_hash(chunk):
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+def load_legacy_pickle_store():
+    try:
+        with open(LEGACY_CHUNKS_FILE_PATH, "rb") as f:
+            chunk_store = pickle.load(f)
+        with open(LEGACY_EMBEDDINGS_FILE_PATH, "rb") as f:
+            embedding_store = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    if isinstance(chunk_store, dict) and isinstance(embedding_store, dict):
+        print(f">> Migrating {LEGACY_CHUNKS_FILE_PATH} and {LEGACY_EMBEDDINGS_FILE_PATH} to the memory-mapped chunk store.")
+        return chunk_store, embedding_store
+    return None
+
+def load_manifest(directory="."):
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if chunk_store_exists(directory):
+            store = ChunkStore(directory)
+            chunk_store = dict(store.items())
+            embeddings = normalize_embeddings(store.embeddings) if len(store) else np.array(store.embeddings)
+            embedding_store = {chunk_id: embeddings[row] for row, chunk_id in enumerate(chunk_store)}
+            return manifest, chunk_store, embedding_store
+        legacy = load_legacy_pickle_store()
+        if legacy:
+            chunk_store, embedding_store = legacy
+            if embedding_store:
+                embeddings = normalize_embeddings(list(embedding_store.values()))
+                embedding_store = dict(zip(embedding_store, embeddings))
+            return manifest, chunk_store, embedding_store
+        print("!! Existing chunk store has no manifest IDs, re-indexing from scratch.")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"!! Failed to load manifest, re-indexing from scratch: {e}")
+    return {"next_id": 0, "index_type": None, "chunks": {}}, {}, {}
+
+def index_factory_string(index_type, count, dim, nlist=FAISS_IVF_NLIST, pq_m=FAISS_PQ_M):
+    # faiss wants at least 39 training vectors per list
+    nlist = max(1, min(nlist, count // 39 or 1))
+    if index_type == "flat":
+        return "IDMap2,Flat"
+    if index_type == "ivf-flat":
+        return f"IVF{nlist},Flat"
+    if index_type == "hnsw":
+        return f"IDMap2,HNSW{FAISS_HNSW_M}"
+    if index_type == "ivf-pq":
+        if count < 2 ** FAISS_PQ_NBITS:
+            print(f"!! {count} vectors are too few to train IVF-PQ, using IVF-Flat instead.")
+            return f"IVF{nlist},Flat"
+        if pq_m < 1 or dim % pq_m:
+            print(f"!! IVF-PQ needs the dimension ({dim}) to be a multiple of the PQ sub-quantizer count ({pq_m}), using IVF-Flat instead.")
+            return f"IVF{nlist},Flat"
+        return f"IVF{nlist},PQ{pq_m}x{FAISS_PQ_NBITS}"
+    raise ValueError(f"Unknown index type {index_type!r}, expected one of {', '.join(INDEX_TYPES)}")
+
+def create_faiss_index(embeddings_np, ids, index_type=FAISS_INDEX_TYPE, nlist=FAISS_IVF_NLIST, pq_m=FAISS_PQ_M,
+                       nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH):
+    count, dim = embeddings_np.shape
+    index = faiss.index_factory(dim, index_factory_string(index_type, count, dim, nlist, pq_m), faiss.METRIC_INNER_PRODUCT)
+    if index_type == "hnsw":
+        faiss.downcast_index(index.index).hnsw.efConstruction = FAISS_HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        index.train(embeddings_np)
+    index.add_with_ids(embeddings_np, ids)
+    set_search_params(index, nprobe, ef_search)
+    return index
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    params = faiss.ParameterSpace()
+    if faiss.try_extract_index_ivf(index) is not None:
+        params.set_index_parameter(index, "nprobe", nprobe or FAISS_NPROBE)
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        params.set_index_parameter(index, "efSearch", ef_search or FAISS_EF_SEARCH)
+
+def build_faiss_index(embedding_store, index_type=FAISS_INDEX_TYPE):
+    ids = np.fromiter(embedding_store.keys(), dtype=np.int64, count=len(embedding_store))
+    embeddings_np = np.array(list(embedding_store.values()), dtype=np.float32)
+    return create_faiss_index(embeddings_np, ids, index_type)
+
+def load_faiss_index(manifest, index_type=FAISS_INDEX_TYPE, directory="."):
+    path = os.path.join(directory, FAISS_INDEX_FILE)
+    if not manifest["chunks"] or not os.path.exists(path):
+        return None
+    if manifest.get("index_type") != index_type:
+        print(f">> Index type changed to {index_type}, rebuilding the FAISS index.")
+        return None
+    if manifest.get("metric") != INDEX_METRIC:
+        print(">> Index was built for L2 search, rebuilding it for inner-product search on normalized vectors.")
+        return None
+    try:
+        index = faiss.read_index(path)
+    except Exception as e:
+        print(f"!! Failed to load existing FAISS index: {e}")
+        return None
+    if index.ntotal != len(manifest["chunks"]):
+        print("!! Existing FAISS index does not match the manifest, rebuilding it.")
+        return None
+    return index
+
+def calibrate_thresholds(chunk_store, embedding_store, sample_size=CALIBRATION_SAMPLE_SIZE, seed=0):
+    # Thresholds are percentiles of scores between randomly paired, presumably unrelated chunks
+    calibration = {"reranker": None}
+    ids = list(embedding_store)
+    if len(ids) < 2:
+        return calibration
+    rng = np.random.default_rng(seed)
+    left, right = rng.integers(len(ids), size=(2, sample_size))
+    pairs = [(ids[i], ids[j]) for i, j in zip(left, right) if i != j]
+    a = np.array([embedding_store[i] for i, _ in pairs], dtype=np.float32)
+    b = np.array([embedding_store[j] for _, j in pairs], dtype=np.float32)
+    similarities = (a * b).sum(axis=1)
+    calibration["vector_min_similarity"] = float(np.percentile(similarities, 100 - VECTOR_CALIBRATION_PERCENTILE))
+    print(f">> Calibrated vector similarity cutoff: {calibration['vector_min_similarity']:.3f}")
+    if not RERANK_MODEL:
+        return calibration
+
+    try:
+        reranker = CrossEncoderReranker(RERANK_MODEL, RERANK_BATCH_SIZE)
+        scores = reranker.score_pairs([
+            (" ".join(chunk_store[i].split()[:CALIBRATION_QUERY_WORDS]), chunk_store[j]) for i, j in pairs
+        ])
+    except Exception as e:
+        print(f"!! Re-ranker calibration failed, using the default threshold: {e}")
+        return calibration
+    calibration["reranker"] = RERANK_MODEL
+    calibration["rerank_min_score"] = float(np.percentile(scores, RERANK_CALIBRATION_PERCENTILE))
+    print(f">> Calibrated re-ranker score cutoff: {calibration['rerank_min_score']:.3f}")
+    return calibration
+
+language_detector = LanguageDetector()
+
+def chunk_metadata(chunk):
+    metadata = {key: chunk.get(key) for key in ("source", "page_start", "page_end", "heading")}
+    metadata["language"] = language_detector.classify(chunk["text"])
+    return metadata
+
+def metadata_by_id(manifest):
+    return {entry["id"]: entry for entry in manifest["chunks"].values()}
+
+def embed_with_journal(texts, hashes, provider, journal):
+    journaled = journal.load()
+    pending = [i for i, h in enumerate(hashes) if h not in journaled]
+    if len(pending) < len(hashes):
+        print(f">> Resuming: {len(hashes) - len(pending)} of {len(hashes)} new chunks were already embedded in {journal.path}")
+    count("resumed_chunks", len(hashes) - len(pending))
+    fresh = {}
+    if pending:
+        def record(start, end, batch_embeddings):
+            # Durable before the batch counts as done, so a crash or exhausted quota loses at most the batches in flight
+            journal.append([hashes[i] for i in pending[start:end]], batch_embeddings)
+
+        try:
+            embeddings = generate_embeddings([texts[i] for i in pending], provider=provider, on_batch=record)
+        finally:
+            journal.close()
+        if embeddings:
+            fresh = {hashes[i]: embedding for i, embedding in zip(pending, embeddings)}
+    return [journaled[h] if h in journaled else fresh.get(h) for h in hashes]
+
+def update_index(chunks, index_type=FAISS_INDEX_TYPE, provider=None, index_dir=INDEX_DIR):
+    provider = provider or get_embedding_provider()
+    directory = current_index_dir(index_dir)
+    manifest, chunk_store, embedding_store = load_manifest(directory)
+    # Indexes built before providers were recorded all used the Azure deployment
+    built_with = manifest.get("embedding_provider") or f"azure:{AZURE_DEPLOYMENT_EMBEDDINGS}"
+    if manifest["chunks"] and built_with != provider.name:
+        print(f">> Index was built with {built_with}, re-embedding all chunks with {provider.name}.")
+        manifest["chunks"] = {}
+        chunk_store.clear()
+        embedding_store.clear()
+    manifest["embedding_provider"] = provider.name
+    current = {}
+    for chunk in chunks:
+        current.setdefault(chunk_hash(chunk["text"]), chunk)
+    added = [h for h in current if h not in manifest["chunks"]]
+    removed = [h for h in manifest["chunks"] if h not in current]
+    print(f">> Chunks: {len(current) - len(added)} unchanged, {len(added)} new, {len(removed)} removed")
+    metadata_changed = False
+    for h, entry in manifest["chunks"].items():
+        if h in current:
+            updated = dict(entry, **chunk_metadata(current[h]))
+            metadata_changed |= updated != entry
+            entry.update(updated)
+    if not added and not removed and manifest.get("index_type") == index_type and manifest.get("metric") == INDEX_METRIC:
+        recalibrate = manifest.get("calibration", {}).get("reranker", "") != (RERANK_MODEL or None)
+        # Builds from before versioned directories are republished into one
+        if not (metadata_changed or recalibrate or directory == "." or not lexical_index_exists(directory)
+                or not os.path.exists(os.path.join(directory, CHUNK_METADATA_FILE))):
+            print("✓ Index is already up to date.")
+            return True
+        print(">> Vectors are up to date, republishing the derived files.")
+        if recalibrate:
+            manifest["calibration"] = calibrate_thresholds(chunk_store, embedding_store)
+        index = load_faiss_index(manifest, index_type, directory)
+        with span("save"):
+            return publish_index(index or build_faiss_index(embedding_store, index_type), chunk_store, embedding_store,
+                                 manifest, index_dir)
+
+    annotate(unchanged=len(current) - len(added), added=len(added), removed=len(removed))
+    journal = EmbeddingJournal(os.path.join(index_dir, EMBEDDING_JOURNAL_FILE), provider.name)
+    with span("embed", chunks=len(added), provider=provider.name):
+        embeddings = embed_with_journal([current[h]["text"] for h in added], added, provider, journal) if added else []
+    failed = sum(embedding is None for embedding in embeddings)
+    if failed:
+        # Publishing now would drop these chunks (and any they replace); the journal lets a rerun pick up from here
+        print(f"!! {failed} of {len(added)} new chunks could not be embedded, keeping the current index. "
+              f"Rerun to resume from {journal.path}.")
+        return False
+
+    index = load_faiss_index(manifest, index_type, directory)
+    if index is not None and removed and index_type == "hnsw":
+        index = None
+
+    removed_ids = []
+    for h in removed:
+        chunk_id = manifest["chunks"].pop(h)["id"]
+        chunk_store.pop(chunk_id, None)
+        embedding_store.pop(chunk_id, None)
+        removed_ids.append(chunk_id)
+
+    added_ids, added_embeddings = [], []
+    for h, embedding in zip(added, embeddings):
+        embedding = normalize_embeddings(embedding)[0]
+        chunk_id = manifest["next_id"]
+        manifest["next_id"] += 1
+        manifest["chunks"][h] = dict(chunk_metadata(current[h]), id=chunk_id)
+        chunk_store[chunk_id] = current[h]["text"]
+        embedding_store[chunk_id] = embedding
+        added_ids.append(chunk_id)
+        added_embeddings.append(embedding)
+
+    if not embedding_store:
+        print("!! No embeddings left to index, skipping index save.")
+        return False
+
+    manifest["index_type"] = index_type
+    manifest["metric"] = INDEX_METRIC
+    with span("calibrate"):
+        manifest["calibration"] = calibrate_thresholds(chunk_store, embedding_store)
+    with span("faiss", rebuild=index is None):
+        if index is None:
+            index = build_faiss_index(embedding_store, index_type)
+        else:
+            if removed_ids:
+                index.remove_ids(np.array(removed_ids, dtype=np.int64))
+            if added_ids:
+                index.add_with_ids(np.array(added_embeddings, dtype=np.float32), np.array(added_ids, dtype=np.int64))
+    with span("save"):
+        if not publish_index(index, chunk_store, embedding_store, manifest, index_dir):
+            return False
+    # The published chunk store now holds these vectors
+    journal.discard()
+    return True
+
+def publish_index(index, chunk_store, embedding_store, manifest, index_dir=INDEX_DIR):
+    version = new_index_version()
+    try:
+        staging = staging_index_dir(index_dir, version)
+    except Exception as e:
+        print(f"!! Failed to create a build directory in {index_dir}: {e}")
+        return False
+    # Everything is written next to nothing the server reads, then swapped in at once
+    published = save_faiss_index(index, staging) and save_chunk_store(chunk_store, embedding_store, manifest, staging) \
+        and save_lexical_index(chunk_store, staging) and save_manifest(manifest, staging)
+    if published:
+        try:
+            write_index_version(staging, version)
+            directory = publish_index_dir(staging, index_dir, version)
         except Exception as e:
-            print(f"!! Embedding error on batch {i // batch_size + 1}: {e}")
-            time.sleep(10)
-    return embeddings if embeddings else None
+            print(f"!! Failed to publish index version {version}: {e}")
+            published = False
+    if not published:
+        shutil.rmtree(staging, ignore_errors=True)
+        return False
+    print(f"✓ Published index version {version}: {directory}")
+    prune_index_dirs(index_dir, INDEX_KEEP_VERSIONS)
+    return True
 
-def save_faiss_index(chunks, embeddings):
-    if not embeddings:
-        print("!! No embeddings generated, skipping index save.")
-        return
+def save_faiss_index(index, directory="."):
     try:
-        embeddings_np = np.array(embeddings, dtype=np.float32)
-        index = faiss.IndexFlatL2(embeddings_np.shape[1])
-        index.add(embeddings_np)
-        faiss.write_index(index, FAISS_INDEX_PATH)
-        print(f"✓ FAISS index saved: {FAISS_INDEX_PATH}")
+        faiss.write_index(index, os.path.join(directory, FAISS_INDEX_FILE))
+        print(f"✓ FAISS index saved: {index.ntotal} vectors")
+        return True
     except Exception as e:
         print(f"!! Failed to save FAISS index: {e}")
+        return False
+
+def save_chunk_store(chunk_store, embedding_store, manifest, directory="."):
+    try:
+        write_chunk_store(chunk_store, embedding_store, directory, metadata_by_id(manifest))
+        print(f"✓ Chunks, embeddings and metadata saved: {len(chunk_store)} chunks")
+        return True
+    except Exception as e:
+        print(f"!! Failed to save chunk store: {e}")
+        return False
+
+def save_lexical_index(chunk_store, directory="."):
     try:
-        with open(CHUNKS_FILE_PATH, "wb") as f:
-            pickle.dump(chunks, f)
-        print(f"✓ Chunks saved: {CHUNKS_FILE_PATH}")
+        write_lexical_index(chunk_store, directory)
+        print(f"✓ BM25 index saved: {len(chunk_store)} chunks")
+        return True
     except Exception as e:
-        print(f"!! Failed to save chunks: {e}")
+        print(f"!! Failed to save BM25 index: {e}")
+        return False
+
+def save_manifest(manifest, directory="."):
     try:
-        with open(EMBEDDINGS_FILE_PATH, "wb") as f:
-            pickle.dump(embeddings, f)
-        print(f"✓ Embeddings saved: {EMBEDDINGS_FILE_PATH}")
+        with open(os.path.join(directory, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        print("✓ Manifest saved")
     except Exception as e:
-        print(f"!! Failed to save embeddings: {e}")
+        print(f"!! Failed to save manifest: {e}")
+        return False
+    return True
+
+def synthetic_embeddings(count, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, count // 100), dim)).astype(np.float32)
+    embeddings_np = centers[rng.integers(0, len(centers), size=count)]
+    embeddings_np += rng.normal(scale=0.3, size=(count, dim)).astype(np.float32)
+    return embeddings_np
+
+def evaluate_index_types(embeddings_np, index_types=INDEX_TYPES, k=10, query_count=500, seed=0, nlist=FAISS_IVF_NLIST,
+                         nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH, pq_m=FAISS_PQ_M):
+    rng = np.random.default_rng(seed)
+    embeddings_np = normalize_embeddings(embeddings_np)
+    count, dim = embeddings_np.shape
+    rows = rng.choice(count, size=min(query_count, count), replace=False)
+    noise = rng.normal(scale=0.1 * float(embeddings_np.std()), size=(len(rows), dim))
+    queries = normalize_embeddings(embeddings_np[rows] + noise)
+    ids = np.arange(count, dtype=np.int64)
+
+    exact = faiss.IndexFlatIP(dim)
+    exact.add(embeddings_np)
+    _, truth = exact.search(queries, k)
+
+    results = []
+    for index_type in index_types:
+        started = time.perf_counter()
+        index = create_faiss_index(embeddings_np, ids, index_type, nlist, pq_m, nprobe, ef_search)
+        build_seconds = time.perf_counter() - started
+
+        latencies = []
+        found = np.empty_like(truth)
+        for i in range(len(queries)):
+            started = time.perf_counter()
+            _, found[i:i + 1] = index.search(queries[i:i + 1], k)
+            latencies.append((time.perf_counter() - started) * 1000)
 
-def main():
-    raw_chunks = extract_text_blocks_by_headings(LOCAL_PDF_FILE_PATH)
-    if not raw_chunks:
-        print("!! No content extracted from PDF.")
+        hits = sum(len(set(found[i]) & set(truth[i])) for i in range(len(queries)))
+        results.append({
+            "index_type": index_type,
+            "recall_at_k": hits / (len(queries) * k),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "memory_mb": faiss.serialize_index(index).nbytes / 2 ** 20,
+            "build_s": build_seconds,
+        })
+    return results
+
+def eval_index(args):
+    if args.synthetic:
+        embeddings_np = synthetic_embeddings(args.synthetic, args.dim)
+    elif chunk_store_exists(current_index_dir(INDEX_DIR)):
+        embeddings_np = np.ascontiguousarray(ChunkStore(current_index_dir(INDEX_DIR)).embeddings)
+    else:
+        print("!! No stored embeddings found, run the indexer first or pass --synthetic.")
         return
-    chunks = refine_chunks_with_token_limit(raw_chunks)
-    print(f">> Total refined chunks: {len(chunks)}")
-    embeddings = generate_embeddings(chunks)
-    save_faiss_index(chunks, embeddings)
-    print("✓✓ Indexing completed successfully.")
+    print(f">> Evaluating {', '.join(args.types)} on {len(embeddings_np)} vectors (k={args.k}, "
+          f"nlist={args.nlist}, nprobe={args.nprobe}, efSearch={args.ef_search})")
+    results = evaluate_index_types(embeddings_np, args.types, args.k, args.queries, nlist=args.nlist, nprobe=args.nprobe,
+                                   ef_search=args.ef_search, pq_m=args.pq_m)
+    print(f"{'index':<10} {'recall@k':>9} {'p50 ms':>9} {'p99 ms':>9} {'memory MB':>10} {'build s':>9}")
+    for r in results:
+        print(f"{r['index_type']:<10} {r['recall_at_k']:>9.3f} {r['p50_ms']:>9.3f} {r['p99_ms']:>9.3f} "
+              f"{r['memory_mb']:>10.1f} {r['build_s']:>9.1f}")
+
+def main(sources=None, workers=INGEST_WORKERS, index_type=FAISS_INDEX_TYPE, embedding_provider=None):
+    configure_tracing(TRACE_LOG_PATH)
+    with trace("index", index_type=index_type):
+        with span("extract_chunk"):
+            raw_chunks = iter_text_blocks_by_headings(sources or [LOCAL_PDF_FILE_PATH], workers)
+            chunks = list(refine_chunks_with_token_limit(raw_chunks))
+        if not chunks:
+            print("!! No content extracted from PDF.")
+            return False
+        annotate(chunks=len(chunks), sources=len({chunk["source"] for chunk in chunks}))
+        print(f">> Total refined chunks: {len(chunks)} from {len({chunk['source'] for chunk in chunks})} PDF(s)")
+        indexed = update_index(chunks, index_type, get_embedding_provider(embedding_provider))
+        if indexed:
+            print("✓✓ Indexing completed successfully.")
+    if METRICS_TEXTFILE:
+        write_metrics_textfile(METRICS_TEXTFILE)
+    return indexed
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Build and evaluate the FAISS knowledge base.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    index_parser = subparsers.add_parser("index", help="index PDFs (default command)")
+    index_parser.add_argument("sources", nargs="*", help="PDF files, directories or glob patterns (default: input.pdf)")
+    index_parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="processes used to parse PDF pages")
+    index_parser.add_argument("--index-type", choices=INDEX_TYPES, default=FAISS_INDEX_TYPE)
+    index_parser.add_argument("--embedding-provider", choices=EMBEDDING_PROVIDERS, default=EMBEDDING_PROVIDER)
+
+    eval_parser = subparsers.add_parser("eval-index", help="compare recall, latency and memory of index types")
+    eval_parser.add_argument("--types", nargs="+", choices=INDEX_TYPES, default=list(INDEX_TYPES))
+    eval_parser.add_argument("--k", type=int, default=10)
+    eval_parser.add_argument("--queries", type=int, default=500)
+    eval_parser.add_argument("--synthetic", type=int, default=0, help="evaluate on N synthetic vectors instead of the stored embeddings")
+    eval_parser.add_argument("--dim", type=int, default=1536, help="dimension of synthetic vectors")
+    eval_parser.add_argument("--nlist", type=int, default=FAISS_IVF_NLIST)
+    eval_parser.add_argument("--nprobe", type=int, default=FAISS_NPROBE)
+    eval_parser.add_argument("--ef-search", type=int, default=FAISS_EF_SEARCH)
+    eval_parser.add_argument("--pq-m", type=int, default=FAISS_PQ_M)
+
+    if not argv or argv[0] not in subparsers.choices and argv[0] not in ("-h", "--help"):
+        argv = ["index"] + list(argv)
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
-    main()
+    args = parse_args(sys.argv[1:])
+    if args.command == "eval-index":
+        eval_index(args)
+    else:
+        sys.exit(0 if main(args.sources, args.workers, args.index_type, args.embedding_provider) else 1)